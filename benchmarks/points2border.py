@@ -0,0 +1,81 @@
+""" compare points2border with the two pass spatial join implementation used for shapely<2
+
+    python benchmarks/points2border.py 200000
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from pymapbox.utils import _points2border_sjoin, points2border
+
+log = logging.getLogger(__name__)
+
+
+def sample(n, seed=0):
+    """ return n points in areas of about 50 points. 2% of points are in another area. """
+    import geopandas as gpd
+    from scipy.spatial import cKDTree
+
+    rng = np.random.default_rng(seed)
+    seeds = rng.random((max(n // 50, 1), 2))
+    coords = rng.random((n, 2))
+    area = cKDTree(seeds).query(coords)[1]
+    noise = rng.random(n) < 0.02
+    area[noise] = rng.integers(0, len(seeds), noise.sum())
+    return gpd.GeoDataFrame(
+        dict(key=[f"a{x}" for x in area]),
+        geometry=gpd.points_from_xy(*coords.T),
+        crs="epsg:4326",
+    )
+
+
+def bench(points, area_key, **kwargs):
+    """ return dataframe comparing points2border with the two pass implementation
+    :param kwargs: passed to points2border
+    :return: seconds, number of areas, total area and area that differs from the two pass output
+    difference is zero unless an area has two parts with the same number of points. points2border keeps the larger
+    part whereas the two pass implementation keeps either.
+    """
+    import shapely
+
+    if not hasattr(shapely, "get_parts"):
+        log.warning(
+            "points2border needs shapely 2. shapely<2 uses the two pass implementation for both."
+        )
+    rows = []
+    out = dict()
+    funcs = dict(
+        sjoin=_points2border_sjoin,
+        strtree=lambda points, area_key: points2border(points, area_key, **kwargs),
+    )
+    for name, func in funcs.items():
+        start = time.perf_counter()
+        out[name] = func(points, area_key)
+        seconds = time.perf_counter() - start
+        rows.append(
+            dict(
+                method=name,
+                seconds=seconds,
+                areas=len(out[name]),
+                area=out[name].area.sum(),
+            )
+        )
+        log.info(f"points2border {name} {seconds:.1f} seconds")
+    a, b = out["sjoin"].geometry.align(out["strtree"].geometry)
+    rows[1]["difference"] = a.symmetric_difference(b).area.sum()
+    return pd.DataFrame(rows).set_index("method")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "n", type=int, nargs="?", default=20000, help="number of points"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    print(bench(sample(args.n), "key", workers=args.workers))
@@ -0,0 +1,156 @@
+""" build and save many maps in parallel
+
+job is a dict:
+
+* func: function that returns a Map or Twomaps. callable or "module.function"
+* args: list of positional arguments
+* kwargs: dict of keyword arguments
+* filename: passed to save
+* save: dict of other save parameters e.g. external_sources=True
+* title: optional title for map
+* name: label for reporting. default is filename.
+
+arguments that are strings "$name" are replaced by shared[name]. shared inputs are sent to each worker
+process once rather than with every job; and sources encoded from them are cached within each worker.
+
+job file is yaml or json with optional workers, shared and defaults (merged into each job)::
+
+    workers: 4
+    shared:
+      ge: {func: pymapbox.elections.clean.ge, args: [2010]}
+    defaults:
+      func: pymapbox.elections.show.local_map
+      kwargs: {ge: $ge, x: party}
+    jobs:
+      - {args: [2011], filename: local2011}
+      - {args: [2015], filename: local2015}
+"""
+
+import importlib
+import logging
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+import yaml
+
+log = logging.getLogger(__name__)
+
+# shared inputs in worker process. set by _init.
+_shared = dict()
+
+
+def render_many(jobs, workers=None, shared=None):
+    """ build and save maps in a process pool
+    :param jobs: list of job dicts
+    :param workers: number of processes. default cpu_count.
+    :param shared: dict of inputs used by many jobs
+    :return: list of dict(name, filename, build, save, seconds, error) in order of jobs
+
+    a job that fails is reported with its traceback and does not stop the batch
+    """
+    shared = shared or dict()
+    workers = min(workers or os.cpu_count(), len(jobs)) or 1
+    results = [None] * len(jobs)
+    start = perf_counter()
+    with ProcessPoolExecutor(workers, initializer=_init, initargs=(shared,)) as ex:
+        futures = {ex.submit(_run, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # job could not be sent or worker died
+                result = _result(jobs[i])
+                result["error"] = repr(e)
+            results[i] = result
+            if result["error"]:
+                log.error(f"{result['name']} failed\n{result['error']}")
+            else:
+                log.info(f"{result['name']} {result['seconds']:.1f}s")
+
+    failed = sum(1 for r in results if r["error"])
+    log.info(
+        f"{len(jobs) - failed} maps saved; {failed} failed; {perf_counter() - start:.1f}s"
+    )
+    return results
+
+
+def render_file(filename, workers=None):
+    """ render jobs in a yaml or json job file
+    :param workers: number of processes. default is workers in file or cpu_count.
+    :return: list of results as render_many
+    """
+    with open(filename, encoding="utf8") as f:
+        spec = yaml.safe_load(f)
+
+    # shared inputs are computed once here
+    shared = {k: call(v) for k, v in spec.get("shared", dict()).items()}
+
+    defaults = spec.get("defaults", dict())
+    jobs = []
+    for job in spec["jobs"]:
+        job = dict(defaults, **job)
+        job["kwargs"] = dict(
+            defaults.get("kwargs", dict()), **job.get("kwargs", dict())
+        )
+        jobs.append(job)
+
+    return render_many(jobs, workers or spec.get("workers"), shared)
+
+
+def call(spec, shared=None):
+    """ return result of func(*args, **kwargs) from dict
+    :param spec: dict with func, args, kwargs. func can be callable or "module.function".
+    :param shared: dict of values to replace "$name" arguments
+    """
+    func = spec["func"]
+    if isinstance(func, str):
+        module, name = func.rsplit(".", 1)
+        func = getattr(importlib.import_module(module), name)
+    shared = shared or dict()
+    args = [_replace(v, shared) for v in spec.get("args", [])]
+    kwargs = {k: _replace(v, shared) for k, v in spec.get("kwargs", dict()).items()}
+    return func(*args, **kwargs)
+
+
+def _replace(v, shared):
+    if isinstance(v, str) and v.startswith("$") and v[1:] in shared:
+        return shared[v[1:]]
+    return v
+
+
+def _init(shared):
+    """ set shared inputs once per worker """
+    global _shared
+    _shared = shared
+
+
+def _result(job):
+    return dict(
+        name=job.get("name", job.get("filename")),
+        filename=job.get("filename"),
+        build=None,
+        save=None,
+        seconds=None,
+        error=None,
+    )
+
+
+def _run(job):
+    """ build and save one map in worker. return result dict. """
+    result = _result(job)
+    start = perf_counter()
+    try:
+        m = call(job, _shared)
+        if job.get("title"):
+            m.title = job["title"]
+        built = perf_counter()
+        result["build"] = built - start
+        m.save(job["filename"], **job.get("save", dict()))
+        result["save"] = perf_counter() - built
+    except Exception:
+        result["error"] = traceback.format_exc()
+    result["seconds"] = perf_counter() - start
+    return result
@@ -0,0 +1,122 @@
+""" compact binary encoding of geodataframes. decoded to geojson in the browser by static/map.js.
+
+layout is a header then buffers of varints::
+
+    "PMB1" | header length (uint32 little endian) | header json | buffers
+
+header has precision, number of features, properties and the [offset, length] of each buffer.
+
+geometry buffers are the Ragged arrays as counts: type+1 per feature; parts per feature; rings per part;
+coords per ring. coordinates are quantized to integers, delta encoded and zigzagged so most are 1 or 2 bytes.
+
+properties are columnar:
+
+* int: zigzag varints
+* float: float64 little endian. NaN is null.
+* dict: distinct values in header and varint code+1 per feature. 0 is null. used for text, categories and bools.
+"""
+
+import json
+import logging
+import struct
+
+import numpy as np
+import pandas as pd
+
+from .encode import Ragged, column
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"PMB1"
+
+# decimals for coordinates if not set. about 10cm.
+PRECISION = 6
+
+
+def dumps(gdf, columns=None, precision=None):
+    """ return binary encoding of geodataframe
+    :param gdf: geodataframe or dataframe with geometry column
+    :param columns: columns to include as properties. default is all except geometry.
+    :param precision: number of decimals for coordinates. default is PRECISION.
+    :return: bytes
+    """
+    geometry = gdf.geometry.name if hasattr(gdf, "geometry") else "geometry"
+    if columns is None:
+        columns = [c for c in gdf.columns if c != geometry]
+    if precision is None:
+        precision = PRECISION
+    ragged = Ragged.from_geoms(gdf[geometry]).quantize(precision)
+
+    buffers = dict(
+        types=varints(ragged.types + 1),
+        geoms=varints(np.diff(ragged.geoms)),
+        parts=varints(np.diff(ragged.parts)),
+        rings=varints(np.diff(ragged.rings)),
+        coords=varints(zigzag(deltas(ragged.coords, precision))),
+    )
+    props = []
+    for i, c in enumerate(columns):
+        prop, buffers[f"p{i}"] = encode_column(gdf[c])
+        prop["name"] = str(c)
+        props.append(prop)
+
+    index = dict()
+    pos = 0
+    for k, b in buffers.items():
+        index[k] = [pos, len(b)]
+        pos += len(b)
+    header = dict(precision=precision, n=len(ragged), properties=props, buffers=index)
+    header = json.dumps(header, separators=(",", ":")).encode("utf8")
+    return b"".join([MAGIC, struct.pack("<I", len(header)), header, *buffers.values()])
+
+
+def encode_column(s):
+    """ return (dict of type and values, bytes) for a property column """
+    dtype = s.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "iu":
+        return dict(type="int"), varints(zigzag(s.to_numpy().astype(np.int64)))
+    if isinstance(dtype, np.dtype) and dtype.kind == "f":
+        return dict(type="float"), s.to_numpy().astype("<f8").tobytes()
+
+    # distinct json values. code 0 is null.
+    codes, uniques = pd.factorize(pd.Series(column(s)))
+    values = [json.loads(v) for v in uniques]
+    codes = codes + 1
+    if None in values:
+        codes[codes == values.index(None) + 1] = 0
+    return dict(type="dict", values=values), varints(codes)
+
+
+def deltas(coords, precision):
+    """ return flat x, y integer differences from previous coordinate. first is absolute. """
+    q = np.round(np.asarray(coords) * 10 ** precision).astype(np.int64)
+    if len(q):
+        q[1:] = q[1:] - q[:-1].copy()
+    return q.ravel()
+
+
+def zigzag(n):
+    """ return signed ints as unsigned with small magnitudes small e.g. 0, -1, 1, -2 => 0, 1, 2, 3 """
+    n = np.asarray(n, dtype=np.int64)
+    return ((n << 1) ^ (n >> 63)).astype(np.uint64)
+
+
+def varints(values):
+    """ return bytes of unsigned ints as protobuf style varints. 7 bits per byte; high bit set if more follow. """
+    v = np.asarray(values).astype(np.uint64)
+    if not len(v):
+        return b""
+    nbytes = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 10):
+        more = v >> np.uint64(7 * k) > 0
+        if not more.any():
+            break
+        nbytes += more
+    starts = np.cumsum(nbytes) - nbytes
+    out = np.empty(nbytes.sum(), dtype=np.uint8)
+    for k in range(nbytes.max()):
+        i = np.flatnonzero(nbytes > k)
+        byte = (v[i] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= (nbytes[i] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[i] + k] = byte
+    return out.tobytes()
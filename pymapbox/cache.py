@@ -0,0 +1,232 @@
+""" content addressed cache of encoded sources
+
+the same geodataframe is often added to many maps e.g. constituencies for each year.
+fingerprint is a fast hash of geometry wkb, column values and encoding options.
+
+set sources.maxbytes to change the memory bound and sources.path to also cache on disk.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import encode
+
+log = logging.getLogger(__name__)
+
+
+class Cache:
+    """ thread safe LRU cache of text
+    :param maxbytes: memory bound. least recently used items are evicted.
+    :param path: folder for disk cache. None is memory only.
+    """
+
+    def __init__(self, maxbytes=512 * 2 ** 20, path=None):
+        self.maxbytes = maxbytes
+        self.path = path
+        self.items = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.diskhits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        """ return text or None if not cached """
+        with self.lock:
+            text = self.items.get(key)
+            if text is not None:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return text
+        if self.path:
+            try:
+                text = (Path(self.path) / key).read_text(encoding="utf8")
+            except OSError:
+                pass
+            else:
+                self.diskhits += 1
+                self.put(key, text, disk=False)
+                return text
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, text, disk=True):
+        """ add text to cache. evicts least recently used to stay within maxbytes. """
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+            elif len(text) <= self.maxbytes:
+                self.items[key] = text
+                self.nbytes += len(text)
+                while self.nbytes > self.maxbytes:
+                    _, old = self.items.popitem(last=False)
+                    self.nbytes -= len(old)
+        if disk and self.path:
+            filename = Path(self.path) / key
+            filename.parent.mkdir(parents=True, exist_ok=True)
+            tmp = filename.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(text, encoding="utf8")
+            os.replace(tmp, filename)
+
+    def clear(self):
+        """ clear memory cache and counters. disk cache is not removed. """
+        with self.lock:
+            self.items.clear()
+            self.nbytes = 0
+            self.hits = self.diskhits = self.misses = 0
+
+    def stats(self):
+        """ return dict of counters """
+        return dict(
+            hits=self.hits,
+            diskhits=self.diskhits,
+            misses=self.misses,
+            items=len(self.items),
+            nbytes=self.nbytes,
+        )
+
+
+# process wide cache of encoded sources
+sources = Cache()
+
+# simplified geometry by fingerprint of geometry and tolerance e.g. the same wards on a map for each year
+simplified = OrderedDict()
+simplified_lock = threading.Lock()
+
+# number of simplified geometries kept
+SIMPLIFIED = 32
+
+# geometries converted to wkb at a time when hashing
+WKBCHUNK = 10000
+
+
+def fingerprint(df, **options):
+    """ return hash of dataframe contents and options
+    :param df: dataframe or geodataframe. geometry is hashed as wkb.
+    :param options: any other parameters that change the output e.g. precision
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(sorted(options.items())).encode())
+    h.update(repr([(str(c), str(df[c].dtype)) for c in df.columns]).encode())
+    for c in df.columns:
+        s = df[c]
+        if str(s.dtype) == "geometry" or c == "geometry":
+            _wkb(h, s)
+            continue
+        if s.dtype == object and pd.api.types.infer_dtype(s) not in ("string", "empty"):
+            # hash_pandas_object hashes str(v) so 1 and "1" would collide. json text keeps the type.
+            h.update("\n".join(encode.column(s)).encode())
+            continue
+        hashed = pd.util.hash_pandas_object(s, index=False).to_numpy()
+        h.update(np.ascontiguousarray(hashed).tobytes())
+    return h.hexdigest()
+
+
+def _wkb(h, geoms):
+    """ update hash with wkb of each geometry """
+    try:
+        import shapely
+
+        if hasattr(shapely, "to_wkb"):
+            geoms = np.asarray(geoms, dtype=object)
+            for i in range(0, len(geoms), WKBCHUNK):
+                for b in shapely.to_wkb(geoms[i : i + WKBCHUNK]):
+                    h.update(_sized(b))
+            return
+    except ImportError:
+        pass
+    for g in geoms:
+        h.update(_sized(g.wkb if g is not None else None))
+
+
+def _sized(b):
+    """ prefix with length so boundaries are part of hash """
+    if b is None:
+        return b"\0\0\0\0"
+    return len(b).to_bytes(4, "little") + b
+
+
+def simplify(df, tolerance):
+    """ return copy of geodataframe with simplified geometry via cache. parameters as utils.simplify. """
+    from .utils import mapply
+    from .utils import simplify as simplify_df
+
+    if not tolerance:
+        return df
+    geometry = df.geometry.name
+    key = fingerprint(df[[geometry]], tolerance=tolerance)
+    with simplified_lock:
+        values = simplified.get(key)
+        if values is not None:
+            simplified.move_to_end(key)
+    if values is None:
+        # split across processes for large data
+        if len(df) >= 1000:
+            values = mapply(df[[geometry]], simplify_df, tolerance=tolerance)
+        else:
+            values = simplify_df(df[[geometry]], tolerance)
+        values = values.geometry.values
+        with simplified_lock:
+            simplified[key] = values
+            while len(simplified) > SIMPLIFIED:
+                simplified.popitem(last=False)
+    df = df.copy()
+    df[geometry] = values
+    return df
+
+
+def dumps(gdf, columns=None, precision=None, format="geojson"):
+    """ return geojson text from geodataframe via cache. parameters as encode.dumps.
+    :param format: "geojson" or "binary". binary is returned as base64 text.
+    """
+    geometry = gdf.geometry.name if hasattr(gdf, "geometry") else "geometry"
+    if columns is None:
+        columns = [c for c in gdf.columns if c != geometry]
+    key = fingerprint(gdf[[geometry, *columns]], format=format, precision=precision)
+    text = sources.get(key)
+    if text is None:
+        if format == "binary":
+            from . import binary
+
+            data = binary.dumps(gdf, columns=columns, precision=precision)
+            text = base64.b64encode(data).decode("ascii")
+        else:
+            text = encode.dumps(gdf, columns=columns, precision=precision)
+        sources.put(key, text)
+    return text
+
+
+def iterdumps(gdf, columns=None, precision=None, keep=False):
+    """ yield geojson text in chunks via cache. parameters as encode.dumps.
+    on a miss chunks are yielded as they are encoded. streaming is for sources too large to hold in memory so
+    the text is not cached unless keep.
+    :param keep: cache text on a miss
+    """
+    geometry = gdf.geometry.name if hasattr(gdf, "geometry") else "geometry"
+    if columns is None:
+        columns = [c for c in gdf.columns if c != geometry]
+    key = fingerprint(gdf[[geometry, *columns]], format="geojson", precision=precision)
+    text = sources.get(key)
+    if text is not None:
+        yield text
+        return
+
+    kept = []
+    for chunk in encode.iterdumps(gdf, columns=columns, precision=precision):
+        if keep:
+            kept.append(chunk)
+        yield chunk
+    if keep:
+        sources.put(key, "".join(kept))
@@ -0,0 +1,46 @@
+""" command line interface
+
+    pymapbox render jobs.yaml --workers 4
+    pymapbox serve data/output --port 8000
+"""
+
+import argparse
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    """ run command. return exit code. """
+    parser = argparse.ArgumentParser(prog="pymapbox")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    render = commands.add_parser("render", help="build and save maps from a job file")
+    render.add_argument("jobfile", help="yaml or json job file. see pymapbox.batch")
+    render.add_argument("--workers", type=int, help="number of processes")
+
+    serve = commands.add_parser("serve", help="serve folder of saved maps")
+    serve.add_argument("path", help="folder of saved maps, sources and tiles")
+    serve.add_argument("--host", default="127.0.0.1", help="interface to listen on")
+    serve.add_argument("--port", type=int, default=8000, help="port number")
+    serve.add_argument(
+        "--precompress", action="store_true", help="save .gz copies before serving"
+    )
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if args.command == "render":
+        from .batch import render_file
+
+        results = render_file(args.jobfile, workers=args.workers)
+        return 1 if any(r["error"] for r in results) else 0
+
+    if args.command == "serve":
+        from .server import precompress, serve
+
+        if args.precompress:
+            precompress(args.path)
+        serve(args.path, args.host, args.port)
+        return 0
@@ -3,8 +3,10 @@
 import logging
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 
+from ..matches import MatchTable
 from ..utils import fuzzymerge
 from . import get
 
@@ -25,11 +27,12 @@ def ge(year):
         ("North East Hampshire", "Hampshire East"),
         ("North East Somerset", "Somerset North East"),
     ]
+    table = MatchTable(get.data / "matches" / "const.json")
     for a, b in matches:
-        res_ge.loc[res_ge.const == b, "const"] = a
+        table.override(a, b)
 
     # merge (fuzzy)
-    const = fuzzymerge(const, res_ge, "const", 90)
+    const = fuzzymerge(const, res_ge, "const", 90, table=table)
     const = const[["ratio", "geometry"]]
 
     # centroids
@@ -40,32 +43,74 @@ def ge(year):
 
 
 def local(year):
-    wards = get.wards(year)
+    wards, wardcentres = local_all([year], boundary=year)
+    columns = {f"{c}{year}": c for c in LOCALFIELDS}
+    return wards.rename(columns=columns), wardcentres.rename(columns=columns)
+
+
+# parties shown. SNP and PC are NAT; others are Other.
+PARTIES = ["C", "LD", "UKIP", "Lab", "Grn", "NAT"]
+
+# columns per year in local_all
+LOCALFIELDS = ["authority", "party", "votes", "ratio"]
+
+
+def local_all(years, boundary=None):
+    """ return wards with results for each year as columns e.g. party2019, ratio2019
+    results for all years are calculated together and joined to ward geometry once.
+    :param years: list of years
+    :param boundary: year of ward boundaries. default is the boundary of all years. required if years have
+        different boundaries. wards of other years that are not in boundary have no results.
+    :return: wards, wardcentres
+    """
+    vintages = sorted({get.ward_boundary(year) for year in years})
+    if boundary is None:
+        if len(vintages) > 1:
+            raise ValueError(
+                f"years {years} have wardcodes of {vintages} boundaries. set boundary to choose one."
+            )
+        boundary = vintages[0]
+    wards = get.wards(boundary)
     # wards.geometry = borders.geometry.simplify(.003)
 
-    local = get.local(year)
-    del local["year"]
-
-    # calculate ratio
-    df = local.copy()
-    df = pd.crosstab(df.wardcode, df.party, df.votes, aggfunc="sum").reset_index()
-    df.columns.name = ""
-    df = df.fillna(0)
-    df["ratio"] = df.LD / df.drop("LD", axis=1).max(axis=1)
-    df.ratio = df.ratio * 100
-    df = df[["wardcode", "ratio"]]
-
-    # calculate winner and merge
-    local = local.sort_values("votes", ascending=False).drop_duplicates("wardcode")
-    local.loc[local.party.isin(["SNP", "PC"]), "party"] = "NAT"
-    local.loc[
-        ~local.party.isin(["C", "LD", "UKIP", "Lab", "Grn", "NAT"]), "party"
-    ] = "Other"
-    local = local.merge(df, how="left").reset_index(drop=True)
+    res = get.local_table(years)
+    keys = ["year", "wardcode"]
+
+    # ratio of LD to largest other party
+    votes = res.groupby([*keys, "party"], observed=True).votes.sum()
+    votes = votes.unstack("party", fill_value=0)
+    ld = votes["LD"] if "LD" in votes else 0
+    ratio = ld / votes.drop(columns="LD", errors="ignore").max(axis=1) * 100
+
+    # winner is candidate with most votes
+    top = res.loc[res.groupby(keys, observed=True).votes.idxmax().to_numpy()]
+    top = top.set_index(keys)[["authority", "party", "votes"]]
+    cats = top.party.cat.categories
+    grouped = np.where(cats.isin(["SNP", "PC"]), "NAT", cats)
+    grouped = np.where(pd.Index(grouped).isin(PARTIES), grouped, "Other")
+    # missing party has code -1 so is Other
+    top["party"] = np.append(grouped, "Other")[top.party.cat.codes.to_numpy()]
+    top["ratio"] = ratio
+
+    # one column per field and year
+    wide = top[LOCALFIELDS].unstack("year")
+    wide = wide.sort_index(axis=1, level="year", sort_remaining=False)
+    wide.columns = [f"{field}{year}" for field, year in wide.columns]
+    wide.index = wide.index.astype(object)
+
+    # results with wardcodes of other boundaries are lost in merge
+    codes = pd.Index(wards.wardcode)
+    for year in years:
+        found = wide[f"party{year}"].dropna().index
+        missing = (~found.isin(codes)).sum()
+        if missing:
+            log.warning(
+                f"{missing} of {len(found)} wards with {year} results are not in {get.ward_boundary(boundary)} boundaries"
+            )
 
     # merge borders
     wards = wards[["wardcode", "wardname", "geometry"]].merge(
-        local.drop("wardname", axis=1), on=["wardcode"], how="left"
+        wide, left_on="wardcode", right_index=True, how="left"
     )
 
     # centroids
@@ -4,11 +4,17 @@
 * 
 """
 
+import json
 import logging
+import operator
+import os
 import re
+import shutil
 from pathlib import Path
+from time import time
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 
 from ..utils import replace_quotes
@@ -21,38 +27,42 @@ data = Path(__file__).parent.parent.parent / "data"
 ## geography ##########################################################
 
 
-def constituencies(year=2017):
-    """ boundaries unchanged 2010-2020 """
-    path = data / "boundaries"
-    df = gpd.read_file(
-        path
-        / "Westminster_Parliamentary_Constituencies__December_2017__Boundaries_UK-shp/Westminster_Parliamentary_Constituencies__December_2017__Boundaries_UK.shp"
-    )
-    df = df.rename(columns=dict(pcon17nm="const"))
-    replace_quotes(df)
-    df.geometry = df.geometry.to_crs(epsg=4326)
-    return df[["const", "geometry"]]
+def constituencies(year=2017, columns=None, bbox=None):
+    """ boundaries unchanged 2010-2020. columns and bbox as boundaries. """
+    f = "Westminster_Parliamentary_Constituencies__December_2017__Boundaries_UK-shp/Westminster_Parliamentary_Constituencies__December_2017__Boundaries_UK.shp"
+
+    def clean(df):
+        df = df.rename(columns=dict(pcon17nm="const"))
+        return df[["const", "geometry"]]
 
+    return boundaries(f, clean, columns, bbox)
 
-def districts(year):
-    path = data / "boundaries"
+
+def districts(year, columns=None, bbox=None):
+    """ 2015 boundaries. columns and bbox as boundaries. """
     f = "Local_Authority_Districts__December_2015__Boundaries-shp/Local_Authority_Districts__December_2015__Boundaries.shp"
-    df = gpd.read_file(path / f)
-    df = df.rename(columns=dict(lad15nm="authority"))
+
+    def clean(df):
+        df = df.rename(columns=dict(lad15nm="authority"))
+        return df[["authority", "geometry"]]
+
+    df = boundaries(f, clean, columns, bbox)
     df["year"] = year
-    replace_quotes(df)
-    df.geometry = df.geometry.to_crs(epsg=4326)
-    return df[["authority", "year", "geometry"]]
+    return df[[c for c in ["authority", "year", "geometry"] if c in df]]
+
 
+def ward_boundary(year):
+    """ return year of ward boundaries used for year. results up to 2014 have 2011 wardcodes. """
+    if year <= 2014:
+        return 2011
+    return min(year, 2019)
 
-def wards(year):
-    path = data / "boundaries"
-    if (year <= 2010) or (year in [2012, 2013, 2014]):
-        log.warning(f"using 2011 boundary as {year} not available")
-        year = 2011
-    elif year >= 2020:
-        log.warning(f"using 2019 boundary as {year} not available")
-        year = 2019
+
+def wards(year, columns=None, bbox=None):
+    """ columns and bbox as boundaries. """
+    if ward_boundary(year) != year:
+        log.warning(f"using {ward_boundary(year)} boundary as {year} not available")
+        year = ward_boundary(year)
 
     if year == 2011:
         f = "Wards__December_2011__Boundaries_EW_BGC-shp/Wards__December_2011__Boundaries_EW_BGC.shp"
@@ -68,12 +78,193 @@ def wards(year):
         f = "Wards__December_2019__Boundaries_UK_BGC-shp/Wards__December_2019__Boundaries_UK_BGC.shp"
 
     y2 = str(year)[-2:]
-    df = gpd.read_file(path / f)
-    df.columns = [c.lower() for c in df.columns]
-    df = df.rename(columns={f"wd{y2}nm": "wardname", f"wd{y2}cd": "wardcode"})
-    replace_quotes(df)
-    df.geometry = df.geometry.to_crs(epsg=4326)
-    return df[["wardcode", "wardname", "geometry"]]
+
+    def clean(df):
+        df.columns = [c.lower() for c in df.columns]
+        df = df.rename(columns={f"wd{y2}nm": "wardname", f"wd{y2}cd": "wardcode"})
+        return df[["wardcode", "wardname", "geometry"]]
+
+    return boundaries(f, clean, columns, bbox)
+
+
+## boundary cache ######################################################
+
+# change if cleaning changes so cached boundaries are rebuilt
+CACHEVERSION = 2
+
+# load times. list of dict(name, cached, rows, seconds)
+timings = []
+
+
+def boundaries(f, clean, columns=None, bbox=None):
+    """ return cleaned boundaries in epsg 4326 from cache. cache is rebuilt if source files change.
+    :param f: shapefile or folder relative to data/boundaries
+    :param clean: function of raw geodataframe that returns the columns to cache
+    :param columns: columns to load. default is all. geometry is always loaded.
+    :param bbox: minx, miny, maxx, maxy in lat/lon. loads only boundaries that intersect.
+    """
+    start = time()
+    path = data / "boundaries" / f
+    name = Path(f).parts[0]
+    cache = data / "cache" / "boundaries" / name
+    signature = dict(version=CACHEVERSION, files=_signature(path))
+
+    cached = _load(cache, signature, columns, bbox)
+    if cached is None:
+        df = gpd.read_file(path)
+        df = clean(df)
+        replace_quotes(df)
+        df.geometry = df.geometry.to_crs(epsg=4326)
+        _save(df, cache, signature)
+        cached = _load(cache, signature, columns, bbox)
+        hit = False
+    else:
+        hit = True
+
+    seconds = time() - start
+    timings.append(dict(name=name, cached=hit, rows=len(cached), seconds=seconds))
+    log.info(
+        f"{name} {'cached ' if hit else ''}{len(cached)} rows in {seconds:.2f} seconds"
+    )
+    return cached
+
+
+def _signature(path):
+    """ return [name, mtime, size] of files that make up a file, shapefile or folder """
+    if path.is_dir():
+        files = [p for p in path.rglob("*") if p.is_file()]
+    elif path.suffix == ".shp":
+        files = path.parent.glob(f"{path.stem}.*")
+    else:
+        files = [path]
+    return [
+        [str(p.relative_to(path.parent)), p.stat().st_mtime_ns, p.stat().st_size]
+        for p in sorted(files)
+    ]
+
+
+def _format():
+    """ return file suffix. parquet if pyarrow is installed. """
+    try:
+        import pyarrow
+    except ImportError:
+        return ".pkl"
+    return ".parquet"
+
+
+def _fresh(cache, signature):
+    """ return cached file or None if missing or signature has changed """
+    f = cache.with_suffix(_format())
+    try:
+        if json.loads(cache.with_suffix(".json").read_text()) != signature:
+            return None
+    except (OSError, ValueError):
+        return None
+    return f if f.exists() else None
+
+
+def _write(df, cache, signature):
+    """ save dataframe to cache. signature is saved alongside.
+    without pyarrow each column is pickled to a file in a folder so columns can be read alone.
+    """
+    suffix = _format()
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache.with_suffix(f".{os.getpid()}.tmp")
+    f = cache.with_suffix(suffix)
+    if suffix == ".parquet":
+        df.to_parquet(tmp, index=False)
+    else:
+        tmp.mkdir()
+        pd.to_pickle(list(df.columns), tmp / "columns.pkl")
+        for i, c in enumerate(df.columns):
+            df[c].reset_index(drop=True).to_pickle(tmp / f"{i}.pkl")
+    if f.exists() and (f.is_dir() or tmp.is_dir()):
+        # a folder cannot replace or be replaced by a file so move old aside first
+        old = cache.with_suffix(f".{os.getpid()}.old")
+        os.replace(f, old)
+        if old.is_dir():
+            shutil.rmtree(old)
+        else:
+            old.unlink()
+    os.replace(tmp, f)
+    cache.with_suffix(".json").write_text(json.dumps(signature))
+
+
+# filter operators. same as pyarrow.
+FILTERS = {
+    "in": lambda s, v: s.isin(v),
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _read(f, columns=None, filters=None):
+    """ return dataframe from cached file
+    :param filters: list of (column, op, value) where op is in FILTERS. pushed down to parquet.
+    """
+    if f.suffix == ".parquet":
+        df = pd.read_parquet(f, columns=columns, filters=filters)
+    else:
+        names = pd.read_pickle(f / "columns.pkl")
+        if columns is None:
+            columns = names
+        df = pd.DataFrame(
+            {c: pd.read_pickle(f / f"{names.index(c)}.pkl") for c in columns}
+        )
+    # older pyarrow only filters partitions
+    for col, op, value in filters or []:
+        df = df[FILTERS[op](df[col], value).to_numpy()].reset_index(drop=True)
+    return df
+
+
+def _save(df, cache, signature):
+    """ save geodataframe as columns plus wkb and bounds. signature is saved alongside. """
+    import shapely
+
+    geoms = np.asarray(df.geometry.values, dtype=object)
+    if hasattr(shapely, "to_wkb"):
+        wkb = shapely.to_wkb(geoms)
+        bounds = shapely.bounds(geoms)
+    else:
+        wkb = [g.wkb for g in geoms]
+        bounds = np.array([g.bounds for g in geoms], dtype=float).reshape(-1, 4)
+    out = pd.DataFrame(df.drop(columns=df.geometry.name)).reset_index(drop=True)
+    out["wkb"] = wkb
+    out[["minx", "miny", "maxx", "maxy"]] = pd.DataFrame(bounds)
+    _write(out, cache, signature)
+
+
+def _load(cache, signature, columns=None, bbox=None):
+    """ return geodataframe from cache or None if missing or out of date """
+    import shapely
+
+    f = _fresh(cache, signature)
+    if f is None:
+        return None
+
+    bounds = ["minx", "miny", "maxx", "maxy"]
+    filters = None
+    if bbox is not None:
+        x0, y0, x1, y1 = bbox
+        filters = [("minx", "<=", x1), ("maxx", ">=", x0)]
+        filters += [("miny", "<=", y1), ("maxy", ">=", y0)]
+    df = _read(f, None if columns is None else [*columns, "wkb", *bounds], filters)
+
+    wkb = df.wkb.to_numpy()
+    if hasattr(shapely, "from_wkb"):
+        geoms = shapely.from_wkb(wkb)
+    else:
+        from shapely import wkb as loads
+
+        geoms = [loads.loads(bytes(b)) for b in wkb]
+    df = df.drop(columns=["wkb", *bounds])
+    return gpd.GeoDataFrame(
+        df, geometry=gpd.GeoSeries(geoms, index=df.index), crs="epsg:4326"
+    )
 
 
 ## results#############################################################################
@@ -81,19 +272,118 @@ def wards(year):
 
 def ge(year):
     """ ge results 1995-2019 from electoralcalculus """
-    df = pd.read_excel(data / "ge/pivottablefull.xlsx", sheet_name="data")
-    df = df[df.Year == year]
-    df = pd.crosstab(df.Constituency, df.Party, df.Vote, aggfunc="sum")
-    df = df.reset_index().rename(columns=dict(Constituency="const"))
-    df["ratio"] = df.LIB / df.drop(columns="LIB").max(axis=1) * 100
-    df.ratio = df.ratio.fillna(0).astype(int)
+    df = ge_ratios()
+    df = df[df.year == year].rename(columns=dict(Constituency="const"))
+    return df.reset_index(drop=True)[["const", "ratio"]]
+
+
+# ratios for all years with signature of workbook
+_ge = dict()
+
+
+def ge_ratios():
+    """ return year, Constituency, ratio for all years. calculated once per workbook. """
+    path = data / "ge/pivottablefull.xlsx"
+    signature = dict(version=CACHEVERSION, files=_signature(path))
+    if _ge.get("signature") == signature:
+        return _ge["ratios"]
+
+    df = ge_table()
+    df = df.groupby(["Year", "Constituency", "Party"], observed=True).Vote.sum()
+    df = df.unstack("Party")
+    others = df.drop(columns="LIB").max(axis=1)
+    ratio = (df.LIB / others * 100).fillna(0).astype(int)
+    df = ratio.rename("ratio").reset_index().rename(columns=dict(Year="year"))
+    df["Constituency"] = df.Constituency.astype(str)
+
+    _ge.update(signature=signature, ratios=df)
+    return df
+
+
+def ge_table(years=None):
+    """ return Year, Constituency, Party, Vote from ge workbook
+    workbook is converted once to a columnar file with categories. rebuilt if the workbook changes.
+    :param years: list of years to load. default is all.
+    """
+    start = time()
+    path = data / "ge/pivottablefull.xlsx"
+    cache = data / "cache" / "ge"
+    signature = dict(version=CACHEVERSION, files=_signature(path))
+    f = _fresh(cache, signature)
+    hit = f is not None
+
+    if not hit:
+        df = pd.read_excel(path, sheet_name="data")
+        df = df[["Year", "Constituency", "Party", "Vote"]]
+        df = df.astype(dict(Year="int16", Constituency="category", Party="category"))
+        _write(df, cache, signature)
+        f = _fresh(cache, signature)
 
-    return df.reset_index()[["const", "ratio"]]
+    filters = None if years is None else [("Year", "in", list(years))]
+    df = _read(f, filters=filters)
+
+    seconds = time() - start
+    timings.append(dict(name="ge", cached=hit, rows=len(df), seconds=seconds))
+    log.info(f"ge {'cached ' if hit else ''}{len(df)} rows in {seconds:.2f} seconds")
+    return df
 
 
 def local(year):
     """ 2010-2019 from andrew teale """
-    path = data / "local"
+    df = local_table([year])
+    return df[["authority", "wardcode", "wardname", "year", "party", "votes"]]
+
+
+# rows per chunk when reading local csv
+CHUNKROWS = 200000
+
+# dtypes of local csv columns. other columns are dropped.
+LOCALTYPES = dict(
+    authority="category",
+    wardname="category",
+    wardcode="category",
+    party="category",
+    votes="float64",
+)
+
+
+def local_table(years):
+    """ return local results for years from a store with one partition per year
+    partitions are built once from the csv and rebuilt if the csv or ward lookup changes.
+    :param years: list of years
+    :return: dataframe of authority, wardcode, wardname, year, party, votes. votes are int32.
+    """
+    start = time()
+    hits = 0
+    parts = []
+    for year in years:
+        f, params = _local_source(year)
+        files = [f] if year >= 2015 else [f, _lookup_path()]
+        signature = dict(
+            version=CACHEVERSION, files=[_signature(x) for x in files], params=params,
+        )
+        cache = data / "cache" / "local" / f"year={year}"
+        part = _fresh(cache, signature)
+        if part is None:
+            _write(_local_csv(year, f, params), cache, signature)
+            part = _fresh(cache, signature)
+        else:
+            hits += 1
+        parts.append(_read(part))
+    df = _concat(parts)
+
+    seconds = time() - start
+    timings.append(
+        dict(name="local", cached=hits == len(years), rows=len(df), seconds=seconds)
+    )
+    log.info(
+        f"local {hits}/{len(years)} cached {len(df)} rows in {seconds:.2f} seconds"
+    )
+    return df
+
+
+def _local_source(year):
+    """ return csv path and read_csv parameters for year """
     params = dict()
 
     if year == 2010:
@@ -126,23 +416,68 @@ def local(year):
         f = "leap-2019-05-02-partial.csv"
         params = dict(skiprows=1)
 
-    df = pd.read_csv(path / f, index_col=False, names=names, **params)
+    return data / "local" / f, dict(names=names, **params)
+
+
+def _local_csv(year, f, params):
+    """ return typed results for year from csv read in chunks """
+    names = params["names"]
+    usecols = [c for c in names if c in LOCALTYPES]
+    dtype = {c: LOCALTYPES[c] for c in usecols}
+    reader = pd.read_csv(
+        f, index_col=False, usecols=usecols, dtype=dtype, chunksize=CHUNKROWS, **params,
+    )
+    df = _concat(list(reader))
     df = df.rename(columns=dict(wd11nm="wardname", lad11nm="authority"))
-    df["year"] = year
+    df["year"] = np.int16(year)
+    df["votes"] = df.votes.fillna(0).astype("int32")
     replace_quotes(df)
 
     # lookup wardcode
     if year <= 2014:
-        f = (
-            data
-            / "boundaries/Ward_to_Census_Merged_Ward_to_Local_Authority_District__December_2011__Lookup_in_England_and_Wales.csv"
-        )
+        df = df.merge(ward_lookup(), on=["authority", "wardname"], how="left")
+        for col in ["authority", "wardname", "wardcode"]:
+            df[col] = df[col].astype("category")
+
+    # wardcode unique whereas wardname is not (e.g. Abbey is very common)
+    return df[["authority", "wardcode", "wardname", "year", "party", "votes"]]
+
+
+def _lookup_path():
+    return (
+        data
+        / "boundaries/Ward_to_Census_Merged_Ward_to_Local_Authority_District__December_2011__Lookup_in_England_and_Wales.csv"
+    )
+
+
+# ward lookup with signature of csv
+_lookup = dict()
+
+
+def ward_lookup():
+    """ return 2011 authority, wardname, wardcode. read once per csv. """
+    f = _lookup_path()
+    signature = _signature(f)
+    if _lookup.get("signature") != signature:
         lookup = pd.read_csv(f)
         lookup.columns = [c.lower() for c in lookup.columns]
         lookup = lookup.rename(
             columns=dict(wd11nm="wardname", lad11nm="authority", wd11cd="wardcode")
         )
-        df = df.merge(lookup, on=["authority", "wardname"], how="left")
+        lookup = lookup[["authority", "wardname", "wardcode"]]
+        replace_quotes(lookup)
+        _lookup.update(signature=signature, lookup=lookup)
+    return _lookup["lookup"]
 
-    # wardcode unique whereas wardname is not (e.g. Abbey is very common)
-    return df[["authority", "wardcode", "wardname", "year", "party", "votes"]]
+
+def _concat(dfs):
+    """ return concatenated dataframes. categories are combined rather than converted to object. """
+    from pandas.api.types import union_categoricals
+
+    if not dfs:
+        return pd.DataFrame(columns=list(LOCALTYPES))
+    cats = [c for c in dfs[0] if dfs[0][c].dtype.name == "category"]
+    df = pd.concat([d.drop(columns=cats) for d in dfs], ignore_index=True)
+    for c in cats:
+        df[c] = union_categoricals([d[c] for d in dfs])
+    return df[dfs[0].columns]
@@ -1,14 +1,12 @@
 """ define maps """
 
 import logging
-from os.path import expanduser
 
 import pandas as pd
-import yaml
 
 from pymapbox.map import Map
 
-from . import get
+from . import clean, get
 
 log = logging.getLogger(__name__)
 
@@ -24,7 +22,8 @@ def get_map(wards, wardcentres, const, constcentres, x="ratio"):
     m.center = [-1.7083, 52.1917]
     m.zoom = 10
     m.style = "mapbox://styles/mapbox/streets-v11"
-    m.api = yaml.safe_load(open(expanduser("~") + "/.mapbox/creds.yaml"))
+    # about 1m. no visible change at zoom levels used.
+    m.precision = 5
 
     x, cats, colorset, wards = get_cats(x, wards)
 
@@ -49,6 +48,71 @@ def get_map(wards, wardcentres, const, constcentres, x="ratio"):
     return m
 
 
+def local_map(year, ge, x="party"):
+    """ map of local election for year. used by batch jobs.
+
+    :param ge: (const, constcentres) as returned by clean.ge
+    :param x: data column "ratio" or "party".
+    :return: mapbox map
+    """
+    const, constcentres = ge
+    wards, wardcentres = clean.local(year)
+    m = get_map(wards, wardcentres, const, constcentres, x)
+    m.title = f"Local election {year}"
+    return m
+
+
+def local_timeseries_map(years, ge, x="party", boundary=None):
+    """ map of local elections for several years with a slider to select the year.
+    ward geometry is embedded once.
+    results for all years are calculated together and shaded with the same categories.
+
+    :param years: list of years
+    :param ge: (const, constcentres) as returned by clean.ge
+    :param x: data column "ratio" or "party".
+    :param boundary: year of ward boundaries as clean.local_all
+    :return: mapbox map
+    """
+    const, constcentres = ge
+    wards, wardcentres = clean.local_all(years, boundary)
+
+    # categories for all years together so each year is shaded with the same bins
+    long = pd.concat(
+        [
+            wards[["wardcode", f"party{year}", f"ratio{year}"]]
+            .rename(columns={f"party{year}": "party", f"ratio{year}": "ratio"})
+            .assign(year=year)
+            for year in years
+        ],
+        ignore_index=True,
+    )
+    col, cats, colorset, long = get_cats(x, long)
+    data = {year: df[["wardcode", col]] for year, df in long.groupby("year")}
+    wards = wards[["wardcode", "wardname", "geometry"]]
+
+    m = Map()
+    m.center = [-1.7083, 52.1917]
+    m.zoom = 10
+    m.style = "mapbox://styles/mapbox/streets-v11"
+    m.precision = 5
+    m.title = f"Local elections {years[0]}-{years[-1]}"
+
+    m.add_timeseries_layer(
+        "shading",
+        wards,
+        data,
+        key="wardcode",
+        type="fill",
+        x=col,
+        cats=cats,
+        colorset=colorset,
+    )
+    m.add_layer("constituencies", type="line", source=const, paint=dict(line_width=3))
+    m.add_layer("wards", type="line", source="shading")
+    m.add_layer("wardnames", type="symbol", source=wardcentres, x="wardname")
+    return m
+
+
 def get_ipy(wards, wardcentres, const, constcentres, x="ratio"):
     from ipyleaflet import Map, Marker, GeoJSON, basemaps, GeoData, LayersControl
     from pymapbox.utils import geojson
@@ -0,0 +1,328 @@
+""" fast geojson encoding of geodataframes
+
+Walks geometry coordinate arrays and property columns in bulk and writes geojson text in one pass.
+Replaces writing via fiona then json.loads then json.dumps.
+"""
+
+import datetime
+import json
+import logging
+import math
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# shapely geometry type ids
+(
+    POINT,
+    LINESTRING,
+    LINEARRING,
+    POLYGON,
+    MULTIPOINT,
+    MULTILINESTRING,
+    MULTIPOLYGON,
+    COLLECTION,
+) = range(8)
+TYPES = [
+    "Point",
+    "LineString",
+    "LineString",
+    "Polygon",
+    "MultiPoint",
+    "MultiLineString",
+    "MultiPolygon",
+    "GeometryCollection",
+]
+
+# compact json
+_dumps = json.JSONEncoder(separators=(",", ":")).encode
+_encode_str = json.encoder.encode_basestring_ascii
+
+
+def dumps(gdf, columns=None, precision=None):
+    """ return geojson text from geodataframe
+    :param gdf: geodataframe or dataframe with geometry column
+    :param columns: columns to include as properties. default is all except geometry.
+    :param precision: number of decimals for coordinates. default is full precision.
+    :return: geojson FeatureCollection as str
+    """
+    return "".join(iterdumps(gdf, columns, precision, chunksize=max(len(gdf), 1)))
+
+
+def iterdumps(gdf, columns=None, precision=None, chunksize=2000):
+    """ yield geojson text in chunks. parameters as dumps.
+    :param chunksize: rows encoded per chunk. only one chunk of text is in memory at a time.
+    """
+    geometry = gdf.geometry.name if hasattr(gdf, "geometry") else "geometry"
+    if columns is None:
+        columns = [c for c in gdf.columns if c != geometry]
+
+    yield '{"type":"FeatureCollection","features":['
+    for start in range(0, len(gdf), chunksize):
+        chunk = gdf.iloc[start : start + chunksize]
+        ragged = Ragged.from_geoms(chunk[geometry])
+        if precision is not None:
+            ragged = ragged.quantize(precision)
+        geoms = ragged.geojson()
+        props = properties(chunk[columns])
+
+        features = [
+            '{"type":"Feature","properties":%s,"geometry":%s}' % row
+            for row in zip(props, geoms)
+        ]
+        yield ("," if start else "") + ",".join(features)
+    yield "]}"
+
+
+def properties(df):
+    """ return list of json objects as text for each row in df """
+    keys = [_encode_str(str(col)) + ":" for col in df.columns]
+    cols = [column(df[col]) for col in df.columns]
+    if not cols:
+        return ["{}"] * len(df)
+    return ["{%s}" % ",".join(k + v for k, v in zip(keys, row)) for row in zip(*cols)]
+
+
+def column(s):
+    """ return list of json text for each value in series
+    handles NaN, numpy scalars, datetimes and categoricals
+    """
+    dtype = s.dtype
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        # encode each category once. code -1 is missing.
+        cats = column(pd.Series(s.cat.categories)) + ["null"]
+        return [cats[c] for c in s.cat.codes.tolist()]
+
+    if isinstance(dtype, np.dtype):
+        if dtype.kind == "b":
+            return ["true" if v else "false" for v in s.tolist()]
+        if dtype.kind in "iu":
+            return list(map(str, s.tolist()))
+        if dtype.kind == "f":
+            values = s.to_numpy()
+            text = list(map(repr, values.tolist()))
+            for i in np.flatnonzero(~np.isfinite(values)).tolist():
+                text[i] = "null"
+            return text
+
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return column(s.dt.strftime("%Y-%m-%dT%H:%M:%S").astype(object))
+
+    values = s.tolist()
+    if all(isinstance(v, str) for v in values):
+        return list(map(_encode_str, values))
+    return list(map(value, values))
+
+
+def value(v):
+    """ return json text for a single value """
+    if v is None or v is pd.NaT or v is pd.NA:
+        return "null"
+    if isinstance(v, str):
+        return _encode_str(v)
+    if isinstance(v, float):
+        return repr(float(v)) if math.isfinite(v) else "null"
+    if isinstance(v, np.datetime64):
+        return value(pd.Timestamp(v))
+    if isinstance(v, np.generic):
+        return value(v.item())
+    if isinstance(v, (datetime.date, datetime.time)):
+        return _encode_str(v.isoformat())
+    try:
+        return _dumps(v)
+    except (TypeError, ValueError):
+        return _encode_str(str(v))
+
+
+class Ragged:
+    """ geometries as a flat coordinate array plus offsets
+
+    every geometry is nested as parts => rings => coords
+    Point 1 part of 1 ring; Multi* n parts; Polygon part has exterior followed by interiors
+
+    :param types: type id per geometry. -1 for missing or empty.
+    :param coords: float array (ncoords, 2)
+    :param rings: offsets into coords for each ring (nrings+1)
+    :param parts: offsets into rings for each part (nparts+1)
+    :param geoms: offsets into parts for each geometry (ngeoms+1)
+    """
+
+    def __init__(self, types, coords, rings, parts, geoms):
+        self.types = types
+        self.coords = coords
+        self.rings = rings
+        self.parts = parts
+        self.geoms = geoms
+
+    def __len__(self):
+        return len(self.types)
+
+    @classmethod
+    def from_geoms(cls, geoms):
+        """ create from GeoSeries or sequence of shapely geometries """
+        geoms = np.asarray(geoms, dtype=object)
+        try:
+            import shapely
+
+            if hasattr(shapely, "get_parts"):
+                return cls._from_geoms_vectorized(geoms)
+        except ImportError:
+            pass
+        return cls._from_geoms_loop(geoms)
+
+    @classmethod
+    def _from_geoms_vectorized(cls, geoms):
+        """ shapely>=2 vectorized functions """
+        import shapely
+
+        types = shapely.get_type_id(geoms)
+        types[shapely.is_empty(geoms)] = -1
+        if (types == COLLECTION).any():
+            raise ValueError("GeometryCollection is not supported")
+        valid = np.flatnonzero(types >= 0)
+
+        # parts
+        parts, pindex = shapely.get_parts(geoms[valid], return_index=True)
+        keep = ~shapely.is_empty(parts)
+        parts, pindex = parts[keep], valid[pindex[keep]]
+        geom_offsets = offsets(np.bincount(pindex, minlength=len(geoms)))
+
+        # rings. polygons have exterior plus interiors; other parts are a single ring.
+        ispoly = shapely.get_type_id(parts) == POLYGON
+        counts = np.ones(len(parts), dtype=np.int64)
+        counts[ispoly] += shapely.get_num_interior_rings(parts[ispoly])
+        part_offsets = offsets(counts)
+        rings = np.empty(part_offsets[-1], dtype=object)
+        rings[part_offsets[:-1][~ispoly]] = parts[~ispoly]
+        polyrings, rindex = shapely.get_rings(parts[ispoly], return_index=True)
+        within = np.arange(len(polyrings)) - offsets(counts[ispoly])[rindex]
+        rings[part_offsets[:-1][ispoly][rindex] + within] = polyrings
+
+        # coords
+        coords = shapely.get_coordinates(rings)
+        ring_offsets = offsets(shapely.get_num_coordinates(rings))
+
+        return cls(types, coords, ring_offsets, part_offsets, geom_offsets)
+
+    @classmethod
+    def _from_geoms_loop(cls, geoms):
+        """ shapely<2 loop over geometries using coordinate array interface """
+        types = []
+        coords = []
+        ring_counts = []
+        part_counts = []
+        geom_counts = []
+        for g in geoms:
+            if g is None or g.is_empty:
+                types.append(-1)
+                geom_counts.append(0)
+                continue
+            t = TYPES.index(g.geom_type) if g.geom_type != "LinearRing" else LINEARRING
+            if t == COLLECTION:
+                raise ValueError("GeometryCollection is not supported")
+            types.append(t)
+            parts = [p for p in g.geoms if not p.is_empty] if t >= MULTIPOINT else [g]
+            geom_counts.append(len(parts))
+            for p in parts:
+                rings = [p.exterior, *p.interiors] if p.geom_type == "Polygon" else [p]
+                part_counts.append(len(rings))
+                for r in rings:
+                    c = np.asarray(r.coords)[:, :2]
+                    coords.append(c)
+                    ring_counts.append(len(c))
+
+        coords = np.concatenate(coords) if coords else np.empty((0, 2))
+        return cls(
+            np.array(types, dtype=np.int64),
+            coords,
+            offsets(ring_counts),
+            offsets(part_counts),
+            offsets(geom_counts),
+        )
+
+    def quantize(self, precision):
+        """ return coordinates rounded to precision decimals
+        removes consecutive duplicate vertices and degenerate rings created by rounding
+        polygon without an exterior ring is removed; geometry without parts is missing
+        """
+        coords = np.round(self.coords, precision)
+        nrings = len(self.rings) - 1
+        nparts = len(self.parts) - 1
+        ring_of_coord = np.repeat(np.arange(nrings), np.diff(self.rings))
+        part_of_ring = np.repeat(np.arange(nparts), np.diff(self.parts))
+        geom_of_part = np.repeat(np.arange(len(self)), np.diff(self.geoms))
+
+        # consecutive duplicates within each ring
+        keep = np.ones(len(coords), dtype=bool)
+        keep[1:] = (coords[1:] != coords[:-1]).any(axis=1)
+        keep[self.rings[:-1][np.diff(self.rings) > 0]] = True
+        counts = np.bincount(ring_of_coord[keep], minlength=nrings)
+
+        # degenerate rings. closed ring needs 4 coords; line needs 2.
+        ring_type = self.types[geom_of_part[part_of_ring]]
+        minimum = np.select(
+            [
+                np.isin(ring_type, [POLYGON, MULTIPOLYGON]),
+                np.isin(ring_type, [LINESTRING, LINEARRING, MULTILINESTRING]),
+            ],
+            [4, 2],
+            1,
+        )
+        ring_ok = counts >= minimum
+        part_ok = ring_ok[self.parts[:-1]]
+        ring_ok &= part_ok[part_of_ring]
+        keep &= ring_ok[ring_of_coord]
+
+        types = self.types.copy()
+        geom_counts = np.bincount(geom_of_part[part_ok], minlength=len(self))
+        types[geom_counts == 0] = -1
+        part_counts = np.bincount(part_of_ring[ring_ok], minlength=nparts)[part_ok]
+
+        return Ragged(
+            types,
+            coords[keep],
+            offsets(counts[ring_ok]),
+            offsets(part_counts),
+            offsets(geom_counts),
+        )
+
+    def geojson(self):
+        """ return list of geojson text for each geometry. "null" for missing """
+        coords = self.coords.tolist()
+        rings = self.rings.tolist()
+        parts = self.parts.tolist()
+        geoms = self.geoms.tolist()
+
+        out = []
+        for i, t in enumerate(self.types.tolist()):
+            if t < 0 or geoms[i] == geoms[i + 1]:
+                out.append("null")
+                continue
+            nested = [
+                [coords[rings[r] : rings[r + 1]] for r in range(parts[p], parts[p + 1])]
+                for p in range(geoms[i], geoms[i + 1])
+            ]
+            if t == POINT:
+                c = nested[0][0][0]
+            elif t in (LINESTRING, LINEARRING):
+                c = nested[0][0]
+            elif t == POLYGON:
+                c = nested[0]
+            elif t == MULTIPOINT:
+                c = [part[0][0] for part in nested]
+            elif t == MULTILINESTRING:
+                c = [part[0] for part in nested]
+            else:
+                c = nested
+            out.append('{"type":"%s","coordinates":%s}' % (TYPES[t], _dumps(c)))
+        return out
+
+
+def offsets(counts):
+    """ return offsets array (n+1) from counts """
+    out = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=out[1:])
+    return out
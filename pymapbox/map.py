@@ -1,25 +1,64 @@
+import base64
 import json
 import logging
 import os
-from functools import partial
+from functools import lru_cache
+from io import StringIO
 from os.path import expanduser
 from pathlib import Path
 
-import geopandas
-import pandas as pd
-import plotly.express as px
-import yaml
-import yatl
-from colour import Color
-from IPython.display import HTML
-from yatl import DIV, INPUT, LABEL, SPAN, XML
-
 from .dotdict import autodict, dotdict
-from .utils import change_keys, geojson, tempdir
+
+# heavy packages such as pandas, geopandas and yatl are imported when first used so "import pymapbox" is fast
 
 log = logging.getLogger(__name__)
 
-token = yaml.safe_load(open(expanduser("~") + "/.mapbox/creds.yaml"))
+# colorbrewer Set3 as plotly.express.colors.qualitative.Set3
+SET3 = [
+    "rgb(141,211,199)",
+    "rgb(255,255,179)",
+    "rgb(190,186,218)",
+    "rgb(251,128,114)",
+    "rgb(128,177,211)",
+    "rgb(253,180,98)",
+    "rgb(179,222,105)",
+    "rgb(252,205,229)",
+    "rgb(217,217,217)",
+    "rgb(188,128,189)",
+    "rgb(204,235,197)",
+    "rgb(255,237,111)",
+]
+
+
+def get_token(token=None):
+    """ return mapbox access token. read when a map is rendered rather than on import.
+    :param token: returned if set. otherwise MAPBOX_TOKEN environment variable or ~/.mapbox/creds.yaml.
+    """
+    token = token or os.environ.get("MAPBOX_TOKEN")
+    if token:
+        return token
+    try:
+        return _read_creds(os.path.join(expanduser("~"), ".mapbox", "creds.yaml"))
+    except OSError:
+        log.warning("no mapbox token. set MAPBOX_TOKEN or create ~/.mapbox/creds.yaml")
+        return ""
+
+
+@lru_cache(maxsize=None)
+def _read_creds(filename):
+    import yaml
+
+    with open(filename) as f:
+        return yaml.safe_load(f)
+
+
+def grayscale(cats):
+    """ return list of colors from white to black
+    :param cats: number of colors
+    """
+    from colour import Color
+
+    return [c.hex for c in Color("white").range_to(Color("black"), cats)]
 
 
 class Map:
@@ -38,50 +77,83 @@ class Map:
         # format
         self.layers = []
 
-        # data
+        # data. sources is json for each source created when rendered.
         self.sources = dict()
+        self.sourceskw = dict()
+        self.sourcesopts = dict()
 
         # extra to mapbox
         # [square, triangle]
         self.shapeset = ["\u25a0", "\u25b2"]
-        self.colorset = px.colors.qualitative.Set3
-        self.grayscale = lambda cats: [
-            c.hex for c in Color("white").range_to(Color("black"), cats)
-        ]
+        self.colorset = SET3
+        self.grayscale = grayscale
         self.showlegends = True
         self.showtoggles = True
         self.legends = None
         self.toggles = None
         self.sourcesdf = dict()
+        # timeseries layer => dict(key, period, data by period)
+        self.timeseries = dict()
         self.title = ""
+        # only embed properties referenced by layers
+        self.prune = True
+        # decimals for coordinates. None is full precision.
+        self.precision = None
+        # mapbox access token. None is MAPBOX_TOKEN or ~/.mapbox/creds.yaml.
+        self.token = None
 
         self.excluded = None
         self.excluded = set(self.__dict__) - set(pre_init)
 
     def _repr_html_(self):
-        """ display in notebook as iframe """
-        html = self.html().replace('"', "'")
-        iframe = f'<iframe id="mapframe", srcdoc="{html}" style="border: 0" width="100%", height="500px"></iframe>'
-        return iframe
+        """ display in notebook as iframe. see pymapbox.notebook """
+        from .notebook import iframe
+
+        return iframe(self)
 
     # input #######################################################
 
-    def add_source(self, name=None, data=None, **kwargs):
+    def add_source(
+        self, name=None, data=None, precision=None, encoding="geojson", **kwargs
+    ):
         """ add a data source. store raw dataframe and geojson
         :param name: name of source
-        :param data: geodataframe
+        :param data: geodataframe; geojson dict; geojson text; or url
+        :param precision: decimals for coordinates. default is map precision.
+        :param encoding: "geojson" or "binary" for a geodataframe.
+            binary is quantized integer coordinates and columnar properties decoded in the browser.
+            smaller than geojson and parsed without blocking the page. see pymapbox.binary.
         :param kwargs: any mapbox layer parameters in addition to the above
 
         only required when sharing source between layers
         normally easier to just pass source as parameter to add_layer.
+
+        if data is not a dataframe then add_layer needs cats for fill, circle and shape layers
+
+        geojson is created when rendered so only columns used by layers are included
         """
         # raw dataframe
         self.sourcesdf[name] = data
 
-        # geojson
         kwargs.setdefault("type", "geojson")
-        kwargs["data"] = geojson(data)
-        self.sources[name] = json.dumps(kwargs)
+        self.sourceskw[name] = kwargs
+        self.sourcesopts[name] = dict(precision=precision, encoding=encoding)
+
+    def add_tiled_source(self, name=None, data=None, minzoom=0, maxzoom=14, **kwargs):
+        """ add a vector tile source. tiles are written to disk by save.
+        :param name: name of source. also the source-layer within the tiles.
+        :param data: geodataframe
+        :param minzoom: lowest zoom for tiles
+        :param maxzoom: highest zoom for tiles. higher zooms use these tiles overzoomed.
+        :param kwargs: any mapbox source parameters
+
+        use for large data that is slow to load as geojson. each zoom is simplified and clipped to tiles.
+        tiles are only viewable via a server e.g. "pymapbox serve" as browsers block file urls.
+        """
+        self.sourcesdf[name] = data
+        kwargs.update(type="vector", minzoom=minzoom, maxzoom=maxzoom)
+        self.sourceskw[name] = kwargs
+        self.sourcesopts[name] = dict(precision=None, tiled=True)
 
     def add_layer(self, id=None, **kwargs):
         """ add a layer to the map
@@ -108,6 +180,11 @@ class Map:
         :param visible: visibility of layer
         :param showlegend: False to not show legend. default True.
         :param showtoggle: False to not show toggle. default True.
+        :param precision: decimals for coordinates if source is a dataframe. default is map precision.
+        :param encoding: "geojson" or "binary" if source is a dataframe. see add_source.
+        :param data: dataframe for default cats and labels. default is the source data.
+        :param bands: list of (tolerance, minzoom, maxzoom). creates a layer per band using simplified source.
+            legend and toggle treat the bands as one layer. tolerance 0 is not simplified.
         :param kwargs: any mapbox layer parameters in addition to the above
 
         Layer types as per mapbox style specification
@@ -127,19 +204,21 @@ class Map:
         dd = autodict(kwargs)
         dd.id = id
         dd.layout.visibility = "visible" if dd.pop("visible", True) else "none"
+        bands = dd.pop("bands", None)
 
         # move source data to sources
+        precision = dd.pop("precision", None)
+        encoding = dd.pop("encoding", "geojson")
         if not isinstance(dd.source, str):
-            # minimise to required cols
-            cols = ["geometry"]
-            for col in ["x", "y"]:
-                if col in dd:
-                    cols.append(col)
-            self.add_source(id, dd.source)
+            self.add_source(id, dd.source, precision=precision, encoding=encoding)
             dd.source = id
+        if self.sourcesopts[dd.source].get("tiled"):
+            dd.setdefault("source_layer", dd.source)
 
         # defaults for layers
-        df = self.sourcesdf[dd.source]
+        df = dd.pop("data", None)
+        if df is None:
+            df = self.sourcesdf[dd.source]
         if dd.type == "symbol":
             if "y" in dd:
                 self.add_layer_shape(dd, df)
@@ -150,8 +229,47 @@ class Map:
         elif dd.type == "circle":
             self.add_layer_circle(dd, df)
 
+        from .utils import change_keys
+
         kwargs = change_keys(dd).to_dict()
-        self.layers.append(kwargs)
+        if bands:
+            self.add_bands(kwargs, bands)
+        else:
+            self.layers.append(kwargs)
+
+    def add_bands(self, layer, bands):
+        """ add a layer for each zoom band using simplified copies of source
+        :param layer: layer dict
+        :param bands: list of (tolerance, minzoom, maxzoom)
+        """
+        names = self.simplify(layer["source"], [b[0] for b in bands])
+        if layer["source"] not in names:
+            # full detail is only saved if another layer uses it
+            self.sourcesopts[layer["source"]]["banded"] = True
+        for i, ((_, minzoom, maxzoom), name) in enumerate(zip(bands, names)):
+            band = dict(layer, id=f"{layer['id']}_{i}", group=layer["id"], source=name)
+            band.update(minzoom=minzoom, maxzoom=maxzoom)
+            self.layers.append(band)
+
+    def simplify(self, source, tolerances):
+        """ add simplified copies of source. geometry is simplified once per process for each tolerance.
+        :param tolerances: list of tolerances in degrees. 0 is the source itself.
+        :return: list of source names
+        """
+        from .cache import simplify
+
+        names = [f"{source}_{t}" if t else source for t in tolerances]
+        df = self.sourcesdf[source]
+        if self.sourcesopts[source].get("tiled") or not hasattr(df, "geometry"):
+            log.warning(f"{source} cannot be simplified")
+            return [source] * len(tolerances)
+        for t, name in zip(tolerances, names):
+            if name in self.sourcesdf:
+                continue
+            self.sourcesdf[name] = simplify(df, t)
+            self.sourceskw[name] = dict(self.sourceskw[source])
+            self.sourcesopts[name] = dict(self.sourcesopts[source])
+        return names
 
     def add_layer_symbol(self, dd, df):
         """ create json for plain grey text with no icon """
@@ -191,6 +309,8 @@ class Map:
             # integer cats is qcut with default quartiles
             cats = dd.get("cats", 4)
             if isinstance(cats, int):
+                import pandas as pd
+
                 cats = pd.qcut(x, cats, retbins=True)
             labels = dd.get("labels", [f"<{level}" for level in cats] + ["none"])
 
@@ -255,6 +375,61 @@ class Map:
             labels = dd.get("labels", cats)
             dd.legend = list(zip(labels, colorset)) + list(zip(ycats, shapeset))
 
+    def add_timeseries_layer(
+        self, id, geometry_gdf, data_by_period, key="wardcode", period=None, **kwargs
+    ):
+        """ add layer with one geometry and data for each period e.g. year. a slider selects the period.
+
+        geometry is embedded once with feature ids from key. data for each period is a columnar table
+        applied with setFeatureState so changing period does not reload or reparse geometry.
+
+        :param id: id of layer. also name of the geometry source.
+        :param geometry_gdf: geodataframe with key and geometry
+        :param data_by_period: dict of period to dataframe with key and data columns
+        :param key: column that identifies features in geometry and data
+        :param period: initial period. default is last.
+        :param kwargs: as add_layer e.g. type, x, cats. paint can use data columns.
+            feature state only applies to paint so layout and filter cannot use data columns.
+        """
+        import pandas as pd
+
+        from .utils import expression_columns
+
+        periods = list(data_by_period)
+        data = pd.concat(data_by_period.values(), ignore_index=True)
+
+        # geometry with stable feature ids
+        geometry = geometry_gdf.geometry.name
+        self.add_source(
+            id,
+            geometry_gdf[[key, geometry]],
+            precision=kwargs.pop("precision", None),
+            encoding=kwargs.pop("encoding", "geojson"),
+            promoteId=key,
+        )
+        self.add_layer(id, source=id, data=data, **kwargs)
+
+        # data columns used by layer are read from feature state
+        layers = [
+            layer for layer in self.layers if layer.get("group", layer["id"]) == id
+        ]
+        used = set()
+        for layer in layers:
+            found = expression_columns(layer.get("paint"))
+            used = set(data.columns) if found is None else used | found
+        columns = [c for c in data.columns if c in used and c != key]
+        for layer in layers:
+            layer["paint"] = feature_state(layer.get("paint", dict()), columns)
+
+        self.timeseries[id] = dict(
+            key=key,
+            # zoom bands have a source each
+            sources=sorted({layer["source"] for layer in layers}),
+            columns=columns,
+            period=periods.index(period) if period is not None else len(periods) - 1,
+            data={p: df[[key, *columns]] for p, df in data_by_period.items()},
+        )
+
     # output ###########################################################################
 
     def root(self):
@@ -268,36 +443,230 @@ class Map:
         }
         return r
 
-    def html(self):
+    def html(self, files="map_files", external=None, compress=False, base=None):
         """ return html page
+        :param files: folder for tiles relative to page
+        :param external: folder of page. if set then sources are saved in external/sources rather than inline.
+        :param compress: also save gzipped copy of external sources
+        :param base: url that relative urls are resolved against. default is location of page.
         """
-        with tempdir(Path(__file__).parent.parent / "templates"):
-            html = open(f"../templates/map.html").read()
-            self.legends = self.get_legends()
-            self.toggles = self.get_toggles()
-            return yatl.render(
-                html, delimiters="[[ ]]", context=dict(token=token, map1=self),
-            )
+        f = StringIO()
+        self.write(f, files, external, compress, base, stream=False)
+        return f.getvalue()
+
+    def write(
+        self,
+        file,
+        files="map_files",
+        external=None,
+        compress=False,
+        base=None,
+        stream=True,
+    ):
+        """ write html page to open file. parameters as html.
+        :param stream: encode geojson sources as they are written so only one is in memory at a time
+        """
+        from .templates import write
+
+        self.legends = self.get_legends()
+        self.toggles = self.get_toggles()
+        self.sources = self.get_sources(files, external, compress, stream)
+        token = get_token(self.token)
+        write(file, "map.html", token=token, base=base, map1=self)
+
+    def save(self, filename, external_sources=False, compress=False):
+        """ save map as html
+        tiles are saved in folder {filename}_files
 
-    def save(self, filename):
-        """ save map as html """
+        :param external_sources: save sources as files that can be cached and shared by other maps
+        :param compress: also save gzipped copy of external sources for servers that support it
+        :return: path of html file
+        """
         if not os.path.splitext(filename)[-1]:
             filename = filename + ".html"
         if not filename.find(os.sep) >= 0:
             filename = Path(__file__).parent.parent / "data/output" / filename
+        filename = Path(filename)
+        files = f"{filename.stem}_files"
+        self.save_tiles(filename.parent / files)
+        external = filename.parent if external_sources else None
         with open(filename, "w", encoding="utf8") as f:
-            f.write(self.html())
+            self.write(f, files, external, compress)
+        return filename
+
+    def serve(self, filename="map", port=0):
+        """ save with external sources and serve folder from a local server on a background thread
+        use "pymapbox serve" to serve saved maps from the command line.
+        :param filename: as save
+        :param port: port number. 0 is any free port.
+        :return: url of page
+        """
+        from .server import Server
+
+        filename = self.save(filename, external_sources=True, compress=True)
+        server = Server(filename.parent, port=port).start_thread()
+        url = f"{server.url}/{filename.name}"
+        log.info(f"serving {url}")
+        return url
+
+    def save_tiles(self, path):
+        """ write tiles for tiled sources
+        :param path: folder for tiles. each source is in subfolder container/name.
+        """
+        from .tiles import write_tiles
+
+        for name, opts in self.sourcesopts.items():
+            if not opts.get("tiled"):
+                continue
+            kw = self.sourceskw[name]
+            write_tiles(
+                self.sourcesdf[name],
+                Path(path) / self.container / name,
+                minzoom=kw["minzoom"],
+                maxzoom=kw["maxzoom"],
+                layer=name,
+                columns=self.get_columns(name),
+            )
+
+    def get_sources(
+        self, files="map_files", external=None, compress=False, stream=False
+    ):
+        """ return dict of source name to json
+        geojson text is inserted directly rather than via json.dumps
+        :param files: folder for tiles relative to page
+        :param external: folder of page. if set then sources are saved in external/sources rather than inline.
+        :param compress: also save gzipped copy of external sources
+        :param stream: geojson from dataframes is a generator of chunks encoded when written. see iter_source.
+        """
+        from .utils import save_hashed
+
+        used = {layer.get("source") for layer in self.layers}
+        sources = dict()
+        for name, data in self.sourcesdf.items():
+            if self.sourcesopts[name].get("banded") and name not in used:
+                continue
+            if self.sourcesopts[name].get("tiled"):
+                kwargs = dict(self.sourceskw[name])
+                kwargs["tiles"] = [
+                    f"{files}/{self.container}/{name}/{{z}}/{{x}}/{{y}}.pbf"
+                ]
+                sources[name] = json.dumps(kwargs)
+                continue
+            if (
+                stream
+                and not isinstance(data, (str, dict))
+                and not self.is_binary(name)
+            ):
+                sources[name] = self.iter_source(name, external, compress)
+                continue
+            data = self.encode_source(name)
+            if self.is_binary(name):
+                # base64 or url of sidecar file decoded by map.js
+                if external is not None:
+                    path = save_hashed(
+                        base64.b64decode(data),
+                        Path(external) / "sources",
+                        ".bin",
+                        compress,
+                    )
+                    data = f"sources/{path.name}"
+                kwargs = json.dumps(self.sourceskw[name])
+                sources[name] = f'{kwargs[:-1]}, "binary": "{data}"}}'
+                continue
+            if external is not None and data.startswith("{"):
+                path = save_hashed(
+                    data, Path(external) / "sources", ".geojson", compress
+                )
+                data = json.dumps(f"sources/{path.name}")
+            kwargs = json.dumps(self.sourceskw[name])
+            sources[name] = f'{kwargs[:-1]}, "data": {data}}}'
+        return sources
+
+    def encode_source(self, name):
+        """ return geojson text or url for source data. base64 text if binary. """
+        data = self.sourcesdf[name]
+        if isinstance(data, str):
+            return data if data.lstrip().startswith("{") else json.dumps(data)
+        if isinstance(data, dict):
+            return json.dumps(data)
+        from .cache import dumps
+
+        return dumps(
+            data,
+            columns=self.get_columns(name),
+            precision=self.get_precision(name),
+            format="binary" if self.is_binary(name) else "geojson",
+        )
+
+    def iter_source(self, name, external=None, compress=False):
+        """ yield source json in chunks. geojson is encoded as it is written. parameters as get_sources. """
+        from .cache import iterdumps
+        from .utils import save_hashed
+
+        chunks = iterdumps(
+            self.sourcesdf[name],
+            columns=self.get_columns(name),
+            precision=self.get_precision(name),
+        )
+        kwargs = json.dumps(self.sourceskw[name])
+        if external is not None:
+            path = save_hashed(chunks, Path(external) / "sources", ".geojson", compress)
+            yield f'{kwargs[:-1]}, "data": {json.dumps(f"sources/{path.name}")}}}'
+            return
+        yield f'{kwargs[:-1]}, "data": '
+        yield from chunks
+        yield "}"
+
+    def get_precision(self, name):
+        """ return decimals for coordinates of source. default is map precision. """
+        precision = self.sourcesopts[name]["precision"]
+        return self.precision if precision is None else precision
+
+    def is_binary(self, name):
+        """ return True if source is a dataframe with binary encoding """
+        binary = self.sourcesopts[name].get("encoding") == "binary"
+        return binary and not isinstance(self.sourcesdf[name], (str, dict))
+
+    def get_columns(self, source):
+        """ return columns referenced by paint, layout and filter of all layers using source
+        :return: list of columns. None if all columns are required.
+        """
+        layers = [layer for layer in self.layers if layer.get("source") == source]
+        if not self.prune or not layers:
+            return None
+        from .utils import expression_columns
+
+        cols = set()
+        promoteid = self.sourceskw[source].get("promoteId")
+        if promoteid:
+            cols.add(promoteid)
+        for layer in layers:
+            for k in ["paint", "layout", "filter"]:
+                found = expression_columns(layer.get(k))
+                if found is None:
+                    return None
+                cols |= found
+        df = self.sourcesdf[source]
+        geometry = df.geometry.name if hasattr(df, "geometry") else "geometry"
+        return [c for c in df.columns if c in cols and c != geometry]
 
     def get_legends(self):
         """ return legends mapping labels to colors in first fill layer
         """
+        from yatl import DIV, SPAN
+
         legends = DIV()
+        groups = set()
         for layer in self.layers:
             if not layer.get("showlegend", self.showlegends):
                 continue
             if "legend" not in layer:
                 continue
-            legend = DIV(_id=f"{layer['id']}_legend")
+            group = layer.get("group", layer["id"])
+            if group in groups:
+                continue
+            groups.add(group)
+            legend = DIV(_id=f"{group}_legend")
             for label, color in layer["legend"]:
                 entry = SPAN(_style="display:block; margin:5px")
                 key = SPAN(
@@ -311,14 +680,84 @@ class Map:
 
     def get_toggles(self):
         """ add buttons to toggle layers """
+        from yatl import DIV, INPUT, LABEL
+
         fg = DIV(_class="filter-group")
+        groups = set()
         for layer in self.layers:
             if not layer.get("showtoggle", self.showtoggles):
                 continue
+            group = layer.get("group", layer["id"])
+            if group in groups:
+                continue
+            groups.add(group)
             try:
                 checked = layer["layout"]["visibility"] == "visible"
             except:
                 checked = True
-            fg.append(INPUT(_type="checkbox", _id=layer["id"], _checked=checked,))
-            fg.append(LABEL(layer["id"], _for=layer["id"]))
+            fg.append(INPUT(_type="checkbox", _id=group, _checked=checked,))
+            fg.append(LABEL(group, _for=group))
         return fg
+
+    def get_timeseries(self):
+        """ return dict of layer id to json with periods, feature keys and values of each column for each period
+        text columns are distinct values plus a code for each feature. -1 is missing.
+        """
+        import pandas as pd
+
+        out = dict()
+        for id, ts in self.timeseries.items():
+            key = ts["key"]
+            keys = self.sourcesdf[id][key]
+            data = dict()
+            for p, df in ts["data"].items():
+                if df[key].duplicated().any():
+                    raise ValueError(f"{id} has duplicate {key} in period {p}")
+                data[str(p)] = df.set_index(key).reindex(keys)
+
+            columns = dict()
+            for c in ts["columns"]:
+                values = [df[c] for df in data.values()]
+                if all(v.dtype.kind in "iuf" for v in values):
+                    columns[c] = dict(
+                        data={
+                            p: df[c].astype(object).where(df[c].notna(), None).tolist()
+                            for p, df in data.items()
+                        }
+                    )
+                else:
+                    cats = pd.Categorical(pd.concat(values)).categories
+                    columns[c] = dict(
+                        values=cats.tolist(),
+                        data={
+                            p: pd.Categorical(df[c], cats).codes.tolist()
+                            for p, df in data.items()
+                        },
+                    )
+            spec = dict(
+                sources=ts["sources"],
+                periods=list(data),
+                period=ts["period"],
+                keys=keys.tolist(),
+                columns=columns,
+            )
+            out[id] = json.dumps(spec, default=str)
+        return out
+
+    def get_groups(self):
+        """ return dict of toggle id to list of layer ids e.g. zoom bands """
+        groups = dict()
+        for layer in self.layers:
+            groups.setdefault(layer.get("group", layer["id"]), []).append(layer["id"])
+        return groups
+
+
+def feature_state(expr, columns):
+    """ return expression with ["get", column] replaced by ["feature-state", column] """
+    if isinstance(expr, dict):
+        return {k: feature_state(v, columns) for k, v in expr.items()}
+    if isinstance(expr, list):
+        if len(expr) >= 2 and expr[0] == "get" and expr[1] in columns:
+            return ["feature-state", *expr[1:]]
+        return [feature_state(v, columns) for v in expr]
+    return expr
@@ -0,0 +1,153 @@
+""" persistent table of fuzzy matches
+
+fuzzymerge scores every unmatched key on each run. a MatchTable saves the best matches so later runs, and
+other processes, only score keys that are new. manual matches are saved in the same table and override scores.
+
+    table = MatchTable("data/matches/const.json")
+    table.override("North East Hampshire", "Hampshire East")
+    const = fuzzymerge(const, res_ge, "const", 90, table=table)
+    table.stats()
+
+scores are saved per set of choices i.e. the unmatched keys of the second dataframe. the set is identified by a
+hash of the choices, scorer and scoring options so a different set is scored afresh rather than giving stale matches.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# scorer used by fuzzyscores. saved scores are discarded if this changes e.g. when queries are rechecked.
+SCORER = "fuzzywuzzy.WRatio/2"
+
+# best matches saved per key e.g. for one to one assignment
+KEEP = 5
+
+
+class MatchTable:
+    """ fuzzy matches saved in a json file
+    :param path: json file. None is memory only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        # choices hash => key => [[match, score]] best first
+        self.sets = dict()
+        # key => match
+        self.manual = dict()
+        # source of each key on last call. "manual", "cache" or "scored"
+        self.sources = []
+        # dataframe of key, fuzzykey, fuzzyscore, source for last call. set by fuzzymerge.
+        self.last = None
+        self.hits = 0
+        self.misses = 0
+        self.manuals = 0
+        self.load()
+
+    def load(self):
+        """ read table from file """
+        if not self.path or not Path(self.path).is_file():
+            return
+        d = json.loads(Path(self.path).read_text(encoding="utf8"))
+        self.sets = d.get("sets", dict())
+        self.manual = d.get("manual", dict())
+
+    def save(self):
+        """ write table to file """
+        if not self.path:
+            return
+        filename = Path(self.path)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        tmp = filename.with_name(
+            f"{filename.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        text = json.dumps(dict(manual=self.manual, sets=self.sets), ensure_ascii=False)
+        tmp.write_text(text, encoding="utf8")
+        os.replace(tmp, filename)
+
+    def override(self, key, match):
+        """ set manual match for key. None removes it. """
+        if self.manual.get(key) == match:
+            return
+        if match is None:
+            self.manual.pop(key, None)
+        else:
+            self.manual[key] = match
+        self.save()
+
+    def scores(self, queries, choices, candidates=20, minscore=0, workers=None):
+        """ return scores as utils.fuzzyscores using saved and manual matches. parameters as fuzzyscores.
+        :return: list for each query of [(index of choice, score)] best first
+        """
+        from .utils import fuzzyscores
+
+        # first index for duplicate choices as process.extractOne
+        index = dict()
+        for i, c in enumerate(choices):
+            index.setdefault(c, i)
+        saved = self.sets.setdefault(
+            setkey(choices, candidates=candidates, minscore=minscore), dict()
+        )
+
+        out = [None] * len(queries)
+        self.sources = [None] * len(queries)
+        new = []
+        for i, q in enumerate(queries):
+            if self.manual.get(q) in index:
+                out[i] = [(index[self.manual[q]], 100)]
+                self.sources[i] = "manual"
+            elif q in saved:
+                out[i] = [(index[m], s) for m, s in saved[q]]
+                self.sources[i] = "cache"
+            else:
+                new.append(i)
+
+        if new:
+            scored = fuzzyscores(
+                [queries[i] for i in new], choices, candidates, minscore, workers
+            )
+            for i, row in zip(new, scored):
+                # same as saved so later runs give the same result
+                out[i] = best(row)[:KEEP]
+                self.sources[i] = "scored"
+                saved[queries[i]] = [[choices[c], s] for c, s in out[i]]
+            self.save()
+
+        counts = {s: self.sources.count(s) for s in ("cache", "scored", "manual")}
+        self.hits += counts["cache"]
+        self.misses += counts["scored"]
+        self.manuals += counts["manual"]
+        log.info(f"fuzzy matches {counts}")
+        return [best(row) for row in out]
+
+    def clear(self):
+        """ remove saved scores. manual matches are kept. """
+        self.sets.clear()
+        self.save()
+
+    def stats(self):
+        """ return dict of counters """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            manual=self.manuals,
+            sets=len(self.sets),
+            keys=sum(len(v) for v in self.sets.values()),
+        )
+
+
+def best(row):
+    """ return (choice, score) sorted by score then order of choices. first is as process.extractOne. """
+    return sorted(row, key=lambda x: (-x[1], x[0]))
+
+
+def setkey(choices, **options):
+    """ return hash of set of choices, scorer and options """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr([SCORER, sorted(options.items())]).encode())
+    h.update("\n".join(sorted(set(choices))).encode("utf8"))
+    return h.hexdigest()
@@ -0,0 +1,53 @@
+""" display maps in jupyter
+
+the map page is shown in an iframe srcdoc. by default sources and tiles are saved in a temporary folder
+served by a local server that is started once per kernel. the notebook output then contains only the
+style and layers; data is fetched from the server. sources are content hashed so repeated displays of
+the same data reuse the file and the browser cache.
+
+set mode = "inline" to embed all data in the output e.g. when the browser cannot reach the kernel.
+"""
+
+import atexit
+import html
+import logging
+import shutil
+import tempfile
+import threading
+
+log = logging.getLogger(__name__)
+
+# "server" or "inline"
+mode = "server"
+height = "500px"
+
+_server = None
+_lock = threading.Lock()
+
+
+def server():
+    """ return local server for notebook data. started on first use. """
+    global _server
+    with _lock:
+        if _server is None:
+            from .server import Server
+
+            path = tempfile.mkdtemp(prefix="pymapbox")
+            atexit.register(shutil.rmtree, path, ignore_errors=True)
+            _server = Server(path).start_thread()
+    return _server
+
+
+def iframe(obj):
+    """ return iframe html to display map or twomaps
+    :param obj: Map or Twomaps
+    """
+    if mode == "server":
+        s = server()
+        # tiles are per object as source names are only unique within a map
+        files = f"tiles/{id(obj):x}"
+        obj.save_tiles(s.path / files)
+        page = obj.html(files, s.path, True, base=f"{s.url}/")
+    else:
+        page = obj.html()
+    return f'<iframe srcdoc="{html.escape(page)}" style="border: 0" width="100%" height="{height}"></iframe>'
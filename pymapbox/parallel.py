@@ -0,0 +1,269 @@
+""" persistent process pool to apply a function to chunks of a dataframe
+
+workers are started once and reused by later calls. numeric and categorical columns are copied once into shared
+memory and geometry is shared as wkb so each task only pickles its row range, index and any object columns.
+progress is shown as chunks complete.
+
+    from pymapbox.utils import mapply
+    simplified = mapply(wards, simplify, tolerance=0.001)
+"""
+
+import atexit
+import logging
+import math
+import os
+import threading
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# target size of a chunk when number of chunks is not set
+CHUNKBYTES = 8 * 2 ** 20
+
+# minimum chunks per worker so faster workers take more
+PERWORKER = 4
+
+# numpy kinds that are shared
+NUMERIC = "biufcmM"
+
+_executors = dict()
+_lock = threading.Lock()
+
+
+def executor(workers=None):
+    """ return executor for number of workers. started on first use and shut down at exit. """
+    workers = workers or os.cpu_count()
+    with _lock:
+        if workers not in _executors:
+            _executors[workers] = Executor(workers)
+    return _executors[workers]
+
+
+@atexit.register
+def shutdown():
+    """ stop all workers """
+    with _lock:
+        for ex in _executors.values():
+            ex.shutdown()
+
+
+class Executor:
+    """ pool of worker processes that is reused across calls
+    :param workers: number of processes. default cpu_count.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """ return pool. started if not running. """
+        with self.lock:
+            if self.pool is None:
+                self.pool = Pool(self.workers)
+            return self.pool
+
+    def shutdown(self, wait=True):
+        """ stop workers. wait=False kills them e.g. after an error. """
+        with self.lock:
+            if self.pool is None:
+                return
+            if wait:
+                self.pool.close()
+            else:
+                self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def map(self, df, func, nchunks=None, progress=True, **kwargs):
+        """ return results of func applied to chunks of df concatenated
+        :param df: dataframe or geodataframe
+        :param func: function of (df, **kwargs) returning a dataframe. must be picklable i.e. defined in a module.
+        :param nchunks: number of chunks. default from size of data and number of workers.
+        :param progress: show progress bar
+        :param kwargs: passed to func
+        """
+        from tqdm.auto import tqdm
+
+        if self.workers == 1 or len(df) <= 1:
+            return func(df, **kwargs)
+
+        with Shared(df) as shared:
+            if nchunks is None:
+                nchunks = max(
+                    self.workers * PERWORKER, math.ceil(shared.nbytes / CHUNKBYTES)
+                )
+            nchunks = max(min(nchunks, len(df)), 1)
+            bounds = np.linspace(0, len(df), nchunks + 1).astype(int).tolist()
+            tasks = (
+                (shared.spec, start, stop, shared.objects(start, stop), func, kwargs)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            )
+            pool = self.start()
+            try:
+                results = list(
+                    tqdm(pool.imap(_run, tasks), total=nchunks, disable=not progress)
+                )
+            except BaseException:
+                # workers may still be running tasks for this call
+                self.shutdown(wait=False)
+                raise
+        return pd.concat(results)
+
+
+class Shared:
+    """ dataframe columns in a shared memory block
+    use as a context manager so the block is released
+
+    :param df: dataframe. numeric and categorical columns and geometry are shared; other columns are pickled per chunk.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        geometry = None
+        if hasattr(df, "geometry") and isinstance(df, pd.DataFrame):
+            geometry = df.geometry.name
+
+        arrays = []
+        columns = []
+        self.pickled = []
+        for i, c in enumerate(df.columns):
+            s = df.iloc[:, i]
+            dtype = s.dtype
+            if c == geometry:
+                data, offsets = _wkb(s)
+                columns.append(("geometry", c, len(arrays)))
+                arrays += [offsets, data]
+            elif isinstance(dtype, pd.CategoricalDtype):
+                columns.append(("category", c, len(arrays), dtype))
+                arrays.append(s.cat.codes.to_numpy())
+            elif isinstance(dtype, np.dtype) and dtype.kind in NUMERIC:
+                columns.append(("array", c, len(arrays)))
+                arrays.append(s.to_numpy())
+            else:
+                columns.append(("object", c, len(self.pickled)))
+                self.pickled.append(i)
+
+        # one block with each array aligned to 8 bytes
+        layout = []
+        pos = 0
+        for a in arrays:
+            layout.append((pos, a.dtype.str, a.shape))
+            pos += -(-a.nbytes // 8) * 8
+        self.nbytes = pos
+        self.shm = shared_memory.SharedMemory(create=True, size=max(pos, 1))
+        for (offset, _, _), a in zip(layout, arrays):
+            view = np.ndarray(a.shape, a.dtype, buffer=self.shm.buf, offset=offset)
+            view[...] = a
+            del view
+
+        crs = getattr(df, "crs", None) if geometry is not None else None
+        self.spec = (self.shm.name, layout, columns, geometry, crs)
+
+    def objects(self, start, stop):
+        """ return index and object columns for rows start:stop """
+        chunk = self.df.iloc[start:stop]
+        return chunk.index, [chunk.iloc[:, i] for i in self.pickled]
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load(spec, start, stop, objects):
+    """ return rows start:stop of a shared dataframe
+    :param spec: Shared.spec
+    :param objects: Shared.objects(start, stop)
+    """
+    name, layout, columns, geometry, crs = spec
+    index, pickled = objects
+    shm = _attach(name)
+    try:
+        arrays = [
+            np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+            for offset, dtype, shape in layout
+        ]
+        data = []
+        for kind, c, i, *extra in columns:
+            if kind == "geometry":
+                data.append(_geoms(arrays[i], arrays[i + 1], start, stop))
+            elif kind == "category":
+                codes = arrays[i][start:stop].copy()
+                data.append(pd.Categorical.from_codes(codes, dtype=extra[0]))
+            elif kind == "array":
+                data.append(arrays[i][start:stop].copy())
+            else:
+                # array keeps extension dtypes such as Int64
+                data.append(pickled[i].array)
+        del arrays
+    finally:
+        shm.close()
+
+    df = pd.DataFrame(dict(enumerate(data)), index=index)
+    df.columns = [c for _, c, *_ in columns]
+    if geometry is not None:
+        import geopandas as gpd
+
+        df = gpd.GeoDataFrame(df, geometry=geometry, crs=crs)
+    return df
+
+
+def _run(task):
+    """ apply func to a chunk in a worker """
+    spec, start, stop, objects, func, kwargs = task
+    return func(load(spec, start, stop, objects), **kwargs)
+
+
+def _attach(name):
+    """ return shared memory created by the parent process
+    pool workers share the parent's resource tracker so the block is tracked once and the parent alone
+    unregisters it when it unlinks. unregistering here as well makes the tracker report a KeyError.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name)
+
+
+def _wkb(geoms):
+    """ return (uint8 array of concatenated wkb, offsets) for geometries. missing is zero length. """
+    try:
+        import shapely
+
+        if hasattr(shapely, "to_wkb"):
+            wkbs = shapely.to_wkb(np.asarray(geoms, dtype=object)).tolist()
+        else:
+            raise ImportError
+    except ImportError:
+        wkbs = [None if g is None else g.wkb for g in geoms]
+    wkbs = [b or b"" for b in wkbs]
+    offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in wkbs], out=offsets[1:])
+    return np.frombuffer(b"".join(wkbs), dtype=np.uint8), offsets
+
+
+def _geoms(offsets, data, start, stop):
+    """ return object array of geometries start:stop from wkb """
+    wkbs = [
+        data[offsets[i] : offsets[i + 1]].tobytes() or None for i in range(start, stop)
+    ]
+    try:
+        import shapely
+
+        if hasattr(shapely, "from_wkb"):
+            return shapely.from_wkb(np.array(wkbs, dtype=object))
+    except ImportError:
+        pass
+    from shapely import wkb
+
+    return np.array([wkb.loads(b) if b else None for b in wkbs], dtype=object)
@@ -0,0 +1,308 @@
+""" small local http server for maps, sources and tiles
+
+a local stand in for a cdn. runs on asyncio so concurrent browser requests do not wait for each other.
+
+* etag and last-modified so the browser revalidates with 304 not modified
+* gzip using precompressed .gz copies if present otherwise compressed on the fly and kept in memory
+* byte ranges
+* files in a sources folder are named by content hash so the browser caches them without revalidating
+
+    pymapbox serve data/output --port 8000
+"""
+
+import asyncio
+import gzip
+import logging
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+log = logging.getLogger(__name__)
+
+mimetypes.add_type("application/geo+json", ".geojson")
+mimetypes.add_type("application/x-protobuf", ".pbf")
+
+REASONS = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    416: "Range Not Satisfiable",
+}
+
+# file types worth compressing
+COMPRESS = {
+    ".html",
+    ".js",
+    ".css",
+    ".json",
+    ".geojson",
+    ".pbf",
+    ".bin",
+    ".csv",
+    ".txt",
+    ".svg",
+}
+
+# smaller files are sent as is
+MINSIZE = 1024
+
+
+class Server:
+    """ http server for files in a folder
+    :param path: root folder
+    :param host: interface to listen on. default is local only.
+    :param port: port number. 0 is any free port.
+    :param maxbytes: memory bound for files compressed on the fly
+    """
+
+    def __init__(self, path, host="127.0.0.1", port=0, maxbytes=256 * 2 ** 20):
+        self.path = Path(path).resolve()
+        self.host = host
+        self.port = port
+        self.maxbytes = maxbytes
+        self.server = None
+        self.loop = None
+        # filename => (etag, gzipped bytes)
+        self.gzipped = OrderedDict()
+        self.nbytes = 0
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        """ start listening in current event loop """
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        log.info(f"serving {self.path} at {self.url}")
+
+    def start_thread(self):
+        """ start server in event loop on a daemon thread e.g. to serve while a notebook runs """
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            started.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, name="pymapbox-server", daemon=True).start()
+        started.wait()
+        return self
+
+    async def handle(self, reader, writer):
+        """ respond to requests on one connection until closed """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                headers = dict()
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = header.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    await self.send(writer, 400, dict(), b"")
+                    break
+                status, rheaders, body = await self.respond(method, target, headers)
+                keepalive = (
+                    version == "HTTP/1.1" and headers.get("connection") != "close"
+                )
+                rheaders["Connection"] = "keep-alive" if keepalive else "close"
+                await self.send(
+                    writer, status, rheaders, b"" if method == "HEAD" else body
+                )
+                log.debug(f"{method} {target} {status}")
+                if not keepalive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, headers, body):
+        headers.setdefault("Content-Length", str(len(body)))
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        writer.write(body)
+        await writer.drain()
+
+    async def respond(self, method, target, headers):
+        """ return status, headers, body for a request """
+        if method not in ("GET", "HEAD"):
+            return 405, {"Allow": "GET, HEAD"}, b""
+        filename = self.resolve(unquote(urlsplit(target).path))
+        if filename is None:
+            return 404, dict(), b""
+
+        # pages on other origins e.g. notebooks read sources and tiles
+        rheaders = {
+            "Access-Control-Allow-Origin": "*",
+            "Content-Type": mimetypes.guess_type(str(filename))[0]
+            or "application/octet-stream",
+            "Accept-Ranges": "bytes",
+            "Vary": "Accept-Encoding",
+        }
+        if filename.parent.name == "sources":
+            rheaders["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            rheaders["Cache-Control"] = "no-cache"
+
+        # gzip from precompressed copy or compressed here
+        st = filename.stat()
+        etag = _etag(st)
+        body = None
+        if "gzip" in headers.get("accept-encoding", ""):
+            gz = filename.with_name(filename.name + ".gz")
+            gzst = gz.stat() if gz.is_file() else None
+            if gzst and gzst.st_mtime_ns >= st.st_mtime_ns:
+                filename, st, etag = gz, gzst, _etag(gzst)
+                rheaders["Content-Encoding"] = "gzip"
+            elif filename.suffix in COMPRESS and st.st_size >= MINSIZE:
+                etag = etag[:-1] + '-gz"'
+                rheaders["Content-Encoding"] = "gzip"
+                if etag not in headers.get("if-none-match", ""):
+                    body = await self.compressed(filename, etag)
+
+        rheaders["ETag"] = etag
+        rheaders["Last-Modified"] = formatdate(st.st_mtime, usegmt=True)
+        if etag in headers.get("if-none-match", ""):
+            return 304, rheaders, b""
+
+        # range is ignored if if-range does not match the current file
+        size = st.st_size if body is None else len(body)
+        rng = headers.get("range")
+        if rng and headers.get("if-range", etag) != etag:
+            rng = None
+        rng = byte_range(rng, size)
+        if rng and rng[0] >= rng[1]:
+            rheaders["Content-Range"] = f"bytes */{size}"
+            return 416, rheaders, b""
+        start, end = rng or (0, size)
+        if rng:
+            rheaders["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        status = 206 if rng else 200
+
+        if method == "HEAD":
+            rheaders["Content-Length"] = str(end - start)
+            return status, rheaders, b""
+        if body is None:
+            loop = asyncio.get_event_loop()
+            body = await loop.run_in_executor(None, _read, filename, start, end)
+        else:
+            body = body[start:end]
+        return status, rheaders, body
+
+    async def compressed(self, filename, etag):
+        """ return gzipped file. cached until file changes. """
+        cached = self.gzipped.get(filename)
+        if cached and cached[0] == etag:
+            self.gzipped.move_to_end(filename)
+            return cached[1]
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, filename.read_bytes)
+        body = await loop.run_in_executor(None, gzip.compress, data)
+        if filename in self.gzipped:
+            self.nbytes -= len(self.gzipped.pop(filename)[1])
+        if len(body) <= self.maxbytes:
+            self.gzipped[filename] = (etag, body)
+            self.nbytes += len(body)
+            while self.nbytes > self.maxbytes:
+                _, (_, old) = self.gzipped.popitem(last=False)
+                self.nbytes -= len(old)
+        return body
+
+    def resolve(self, urlpath):
+        """ return file for url path or None if not found or outside root """
+        filename = (self.path / urlpath.lstrip("/")).resolve()
+        if filename != self.path and self.path not in filename.parents:
+            return None
+        if filename.is_dir():
+            filename = filename / "index.html"
+        return filename if filename.is_file() else None
+
+
+def serve(path, host="127.0.0.1", port=8000):
+    """ serve folder until interrupted
+    :param path: root folder e.g. of saved maps
+    """
+
+    async def main():
+        server = Server(path, host, port)
+        await server.start()
+        async with server.server:
+            await server.server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+def precompress(path, minsize=MINSIZE):
+    """ save .gz copy of compressible files in folder that do not have an up to date copy
+    :return: number of files compressed
+    """
+    n = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            filename = Path(root) / f
+            if filename.suffix not in COMPRESS:
+                continue
+            st = filename.stat()
+            if st.st_size < minsize:
+                continue
+            gz = filename.with_name(f + ".gz")
+            if gz.is_file() and gz.stat().st_mtime_ns >= st.st_mtime_ns:
+                continue
+            tmp = gz.with_name(f"{gz.name}.{os.getpid()}.tmp")
+            tmp.write_bytes(gzip.compress(filename.read_bytes()))
+            os.replace(tmp, gz)
+            n += 1
+    log.info(f"{n} files compressed in {path}")
+    return n
+
+
+def byte_range(header, size):
+    """ return (start, end) for a range header or None to send the whole file
+    start >= end if the range cannot be satisfied
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    try:
+        if not first:
+            # suffix e.g. last 500 bytes
+            n = int(last)
+            return (max(size - n, 0), size) if n else (size, size)
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if last and int(last) < start:
+        return None
+    return start, end
+
+
+def _etag(st):
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _read(filename, start, end):
+    with open(filename, "rb") as f:
+        f.seek(start)
+        return f.read(end - start)
@@ -0,0 +1,104 @@
+""" render templates
+
+templates are parsed once into compiled code and parsed again only when a template or included file changes.
+paths are absolute so rendering does not change folder and is safe to call from threads.
+
+output can be written straight to a file. a generator in the context e.g. XML(chunks) is written chunk by chunk
+so large data does not need to be held as one string.
+"""
+
+import logging
+import os
+import threading
+import types
+from io import StringIO
+from pathlib import Path
+
+from yatl.helpers import xmlescape
+from yatl.template import NOESCAPE, TemplateParser, file_reader
+
+log = logging.getLogger(__name__)
+
+path = Path(__file__).parent.parent / "templates"
+delimiters = ["[[", "]]"]
+
+# filename => (code, {dependency: (mtime, size)})
+_compiled = dict()
+_lock = threading.Lock()
+
+
+class FileResponse:
+    """ template response that writes to an open file """
+
+    def __init__(self, file):
+        self.body = file
+
+    def write(self, data, escape=True):
+        if hasattr(data, "xml") and callable(data.xml):
+            data = data.xml()
+        elif escape:
+            data = xmlescape(str(data))
+        if isinstance(data, types.GeneratorType):
+            for chunk in data:
+                self.body.write(chunk)
+            return
+        self.body.write(str(data))
+
+
+def render(filename, **context):
+    """ return rendered template
+    :param filename: template filename in templates folder
+    :param context: variables used in template
+    """
+    f = StringIO()
+    write(f, filename, **context)
+    return f.getvalue()
+
+
+def write(file, filename, **context):
+    """ write rendered template to open file
+    :param file: open text file
+    :param filename: template filename in templates folder
+    :param context: variables used in template
+    """
+    code = compiled(filename)
+    context.update(response=FileResponse(file), NOESCAPE=NOESCAPE)
+    exec(code, context)
+
+
+def compiled(filename):
+    """ return compiled code for template. cached until template or any extended/included file changes. """
+    filename = os.path.normpath(path / filename)
+    with _lock:
+        cached = _compiled.get(filename)
+    if cached and all(_stat(f) == stat for f, stat in cached[1].items()):
+        return cached[0]
+
+    # record files read when parsing extend and include
+    files = dict()
+
+    def reader(f, mode="rb"):
+        f = os.path.normpath(f)
+        files[f] = _stat(f)
+        return file_reader(f, mode)
+
+    parser = TemplateParser(
+        reader(filename),
+        context=dict(),
+        path=str(path),
+        delimiters=delimiters,
+        reader=reader,
+    )
+    code = compile(str(parser), filename, "exec")
+    with _lock:
+        _compiled[filename] = (code, files)
+    log.debug(f"compiled {filename}")
+    return code
+
+
+def _stat(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
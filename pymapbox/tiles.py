@@ -0,0 +1,397 @@
+"""mapbox vector tiles. cut a geodataframe into a z/x/y pyramid of pbf files.
+
+* geometry simplified per zoom and clipped to each tile
+* tiles built in parallel
+* incremental. manifest stores hash of the inputs to each tile so unchanged tiles are not rebuilt.
+
+protobuf encoding follows https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .encode import column
+
+log = logging.getLogger(__name__)
+
+# web mercator
+WORLD = 2 * math.pi * 6378137
+ORIGIN = WORLD / 2
+
+# bump to rebuild all tiles when encoding changes
+VERSION = 1
+
+# worker globals set by _init
+_props = _keys = _path = _layer = _extent = _buffer = None
+
+
+def write_tiles(
+    gdf,
+    path,
+    minzoom=0,
+    maxzoom=14,
+    layer="layer",
+    columns=None,
+    extent=4096,
+    buffer=64,
+    tolerance=1,
+    workers=None,
+):
+    """write tiles as path/z/x/y.pbf
+    :param gdf: geodataframe. crs is assumed to be epsg 4326 if not set.
+    :param path: output folder
+    :param layer: layer name within tiles. mapbox source-layer.
+    :param columns: columns to include as properties. default is all except geometry.
+    :param extent: tile size in tile coordinates
+    :param buffer: tile coordinates outside tile to include when clipping
+    :param tolerance: simplification in pixels assuming 512 pixel tiles
+    :param workers: number of processes. default cpu_count.
+    :return: number of tiles written. unchanged tiles are skipped.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    geometry = gdf.geometry.name
+    if columns is None:
+        columns = [c for c in gdf.columns if c != geometry]
+
+    # project to web mercator
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=4326)
+    geoms = gdf[geometry].to_crs(epsg=3857).reset_index(drop=True)
+    props = [column(gdf[c]) for c in columns]
+    props = [
+        [(k, v) for k, v in enumerate(row) if v != "null"] for row in zip(*props)
+    ] or [[] for _ in range(len(gdf))]
+
+    # feature hashes for incremental build
+    options = json.dumps([VERSION, layer, columns, extent, buffer, tolerance])
+    fhashes = [
+        hashlib.blake2b(
+            (g.wkb if g is not None else b"") + repr(p).encode(), digest_size=8
+        ).digest()
+        for g, p in zip(geoms, props)
+    ]
+    fhashes = np.frombuffer(b"".join(fhashes), np.uint8).reshape(-1, 8)
+
+    manifest_file = path / "manifest.json"
+    try:
+        manifest = json.loads(manifest_file.read_text())
+    except (OSError, ValueError):
+        manifest = dict()
+    if manifest.get("options") != options:
+        manifest = dict(options=options, tiles=dict())
+    old = manifest["tiles"]
+    new = dict()
+
+    # tasks are batches of tiles with the features they need
+    tasks = []
+    bounds = geoms.bounds.to_numpy()
+    for z in range(minzoom, maxzoom + 1):
+        size = WORLD / 2 ** z
+        simplified = geoms.simplify(tolerance * size / 512)
+        index = _tile_index(bounds, z, size * buffer / extent)
+
+        batch = []
+        for (x, y), features in index.items():
+            key = f"{z}/{x}/{y}"
+            h = hashlib.blake2b(key.encode(), digest_size=16)
+            h.update(fhashes[features].tobytes())
+            h = h.hexdigest()
+            new[key] = h
+            if old.get(key) == h and (path / f"{key}.pbf").exists():
+                continue
+            batch.append((z, x, y, features))
+            if len(batch) >= 64:
+                tasks.append(_task(batch, simplified))
+                batch = []
+        if batch:
+            tasks.append(_task(batch, simplified))
+
+    # build
+    initargs = (props, columns, str(path), layer, extent, buffer)
+    if len(tasks) <= 1 or workers == 1:
+        _init(*initargs)
+        written = sum(map(_build, tasks))
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init, initargs=initargs) as ex:
+            written = sum(ex.map(_build, tasks))
+
+    # remove tiles that no longer have data
+    for key in set(old) - set(new):
+        try:
+            os.remove(path / f"{key}.pbf")
+        except OSError:
+            pass
+
+    manifest["tiles"] = new
+    manifest_file.write_text(json.dumps(manifest))
+    log.info(f"{written} tiles written; {len(new) - written} unchanged. {path}")
+    return written
+
+
+def _tile_index(bounds, z, pad):
+    """return dict (x, y) => array of feature indexes whose bounds overlap the tile. sorted by x, y.
+    :param bounds: array of minx, miny, maxx, maxy in web mercator
+    :param pad: buffer around tile in web mercator
+    """
+    size = WORLD / 2 ** z
+    n = 2 ** z
+    i = np.flatnonzero(np.isfinite(bounds).all(axis=1))
+    b = bounds[i]
+    x0 = np.clip((b[:, 0] - pad + ORIGIN) // size, 0, n - 1).astype(np.int64)
+    x1 = np.clip((b[:, 2] + pad + ORIGIN) // size, 0, n - 1).astype(np.int64)
+    y0 = np.clip((ORIGIN - b[:, 3] - pad) // size, 0, n - 1).astype(np.int64)
+    y1 = np.clip((ORIGIN - b[:, 1] + pad) // size, 0, n - 1).astype(np.int64)
+
+    # one row per feature and tile
+    ny = y1 - y0 + 1
+    count = (x1 - x0 + 1) * ny
+    if not count.sum():
+        return dict()
+    feature = np.repeat(i, count)
+    k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    ny = np.repeat(ny, count)
+    x = np.repeat(x0, count) + k // ny
+    y = np.repeat(y0, count) + k % ny
+
+    order = np.lexsort((feature, y, x))
+    feature, x, y = feature[order], x[order], y[order]
+    starts = np.flatnonzero(np.r_[True, (x[1:] != x[:-1]) | (y[1:] != y[:-1])])
+    return dict(
+        zip(zip(x[starts].tolist(), y[starts].tolist()), np.split(feature, starts[1:]),)
+    )
+
+
+def _task(batch, simplified):
+    """return task with wkb for the features in batch"""
+    needed = np.unique(np.concatenate([features for _, _, _, features in batch]))
+    geoms = simplified.values
+    wkb = {i: geoms[i].wkb for i in needed.tolist() if geoms[i] is not None}
+    return batch, wkb
+
+
+def _init(props, columns, path, layer, extent, buffer):
+    """set worker globals once per process"""
+    global _props, _keys, _path, _layer, _extent, _buffer
+    _props, _keys = props, columns
+    _path, _layer, _extent, _buffer = Path(path), layer, extent, buffer
+
+
+def _build(task):
+    """write tiles in task. return number of tiles written"""
+    from shapely import wkb as shapely_wkb
+    from shapely.geometry import box
+
+    batch, wkbs = task
+    geoms = {i: shapely_wkb.loads(b) for i, b in wkbs.items()}
+    written = 0
+    for z, x, y, features in batch:
+        size = WORLD / 2 ** z
+        minx = x * size - ORIGIN
+        maxy = ORIGIN - y * size
+        pad = size * _buffer / _extent
+        clip = box(minx - pad, maxy - size - pad, minx + size + pad, maxy + pad)
+        scale = _extent / size
+
+        encoded = []
+        for i in features:
+            g = geoms.get(i)
+            if g is None or g.is_empty or not g.intersects(clip):
+                continue
+            if g.geom_type != "Point":
+                g = g.intersection(clip)
+            f = _feature(g, minx, maxy, scale)
+            if f:
+                encoded.append((f, _props[i]))
+
+        tile = _layer_pbf(encoded)
+        filename = _path / f"{z}/{x}/{y}.pbf"
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        tmp = filename.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(tile)
+        os.replace(tmp, filename)
+        written += 1
+    return written
+
+
+# geometry ###############################################################
+
+POINT, LINESTRING, POLYGON = 1, 2, 3
+MOVETO, LINETO, CLOSEPATH = 1, 2, 7
+
+
+def _feature(g, minx, maxy, scale):
+    """return (type, geometry commands) in tile coordinates. None if empty after rounding."""
+    points, lines, polygons = [], [], []
+    _split(g, points, lines, polygons)
+
+    def tilecoords(c):
+        c = np.asarray(c)[:, :2]
+        return np.rint((c - (minx, maxy)) * (scale, -scale)).astype(np.int64)
+
+    # geometry type of feature is the highest dimension found after clipping
+    if polygons:
+        rings = []
+        for poly in polygons:
+            exterior = _ring(tilecoords(poly.exterior.coords), exterior=True)
+            if exterior is None:
+                continue
+            rings.append(exterior)
+            for interior in poly.interiors:
+                interior = _ring(tilecoords(interior.coords), exterior=False)
+                if interior is not None:
+                    rings.append(interior)
+        return (POLYGON, _commands(rings, close=True)) if rings else None
+    if lines:
+        lines = [_dedupe(tilecoords(line.coords)) for line in lines]
+        lines = [line for line in lines if len(line) >= 2]
+        return (LINESTRING, _commands(lines, close=False)) if lines else None
+    if points:
+        c = tilecoords([p.coords[0] for p in points])
+        return POINT, _point_commands(c)
+    return None
+
+
+def _split(g, points, lines, polygons):
+    """append simple geometries in g to lists"""
+    if hasattr(g, "geoms"):
+        for part in g.geoms:
+            _split(part, points, lines, polygons)
+    elif g.is_empty:
+        return
+    elif g.geom_type == "Point":
+        points.append(g)
+    elif g.geom_type in ("LineString", "LinearRing"):
+        lines.append(g)
+    elif g.geom_type == "Polygon":
+        polygons.append(g)
+
+
+def _dedupe(c):
+    """remove consecutive duplicates"""
+    if len(c) < 2:
+        return c
+    keep = np.ones(len(c), dtype=bool)
+    keep[1:] = (c[1:] != c[:-1]).any(axis=1)
+    return c[keep]
+
+
+def _ring(c, exterior):
+    """return ring without closing point in mvt winding order. None if degenerate.
+    exterior has positive area in tile coordinates (clockwise with y down). interior negative.
+    """
+    c = _dedupe(c)
+    if len(c) > 1 and (c[0] == c[-1]).all():
+        c = c[:-1]
+    if len(c) < 3:
+        return None
+    x, y = c[:, 0], c[:, 1]
+    area = (x * np.roll(y, -1) - np.roll(x, -1) * y).sum()
+    if area == 0:
+        return None
+    if (area > 0) != exterior:
+        c = c[::-1]
+    return c
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _command(id, count):
+    return (id & 0x7) | (count << 3)
+
+
+def _commands(paths, close):
+    """return command integers for lines or rings"""
+    out = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for c in paths:
+        deltas = np.diff(np.vstack([cursor, c]), axis=0)
+        cursor = c[-1]
+        params = [_zigzag(int(v)) for v in deltas.ravel().tolist()]
+        out.append(_command(MOVETO, 1))
+        out.extend(params[:2])
+        out.append(_command(LINETO, len(c) - 1))
+        out.extend(params[2:])
+        if close:
+            out.append(_command(CLOSEPATH, 1))
+    return out
+
+
+def _point_commands(c):
+    deltas = np.diff(np.vstack([[0, 0], c]), axis=0)
+    return [_command(MOVETO, len(c))] + [
+        _zigzag(int(v)) for v in deltas.ravel().tolist()
+    ]
+
+
+# protobuf ###############################################################
+
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _key(field, wiretype):
+    return _varint((field << 3) | wiretype)
+
+
+def _bytes(field, payload):
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field, values):
+    return _bytes(field, b"".join(map(_varint, values)))
+
+
+def _value(text):
+    """return protobuf Value message from json text of a property"""
+    v = json.loads(text)
+    if isinstance(v, bool):
+        return _key(7, 0) + _varint(int(v))
+    if isinstance(v, int):
+        return _key(6, 0) + _varint(_zigzag(v) & 0xFFFFFFFFFFFFFFFF)
+    if isinstance(v, float):
+        return _key(3, 1) + struct.pack("<d", v)
+    if not isinstance(v, str):
+        v = text
+    return _bytes(1, v.encode("utf8"))
+
+
+def _layer_pbf(features):
+    """return tile with one layer
+    :param features: list of ((type, commands), [(key index, value json)])
+    """
+    values = dict()
+    used = dict()
+    out = []
+    for (gtype, commands), props in features:
+        tags = []
+        for k, v in props:
+            tags.append(used.setdefault(k, len(used)))
+            tags.append(values.setdefault(v, len(values)))
+        feature = _packed(2, tags) if tags else b""
+        feature += _key(3, 0) + _varint(gtype) + _packed(4, commands)
+        out.append(_bytes(2, feature))
+
+    layer = _key(15, 0) + _varint(2) + _bytes(1, _layer.encode("utf8"))
+    layer += b"".join(out)
+    keys = sorted(used, key=used.get)
+    layer += b"".join(_bytes(3, str(_keys[k]).encode("utf8")) for k in keys)
+    layer += b"".join(_bytes(4, _value(v)) for v in values)
+    layer += _key(5, 0) + _varint(_extent)
+    return _bytes(3, layer)
@@ -1,17 +1,12 @@
 import logging
 import os
-from os.path import expanduser
+from io import StringIO
 from pathlib import Path
 
-import yaml
-import yatl
-
-from .utils import tempdir
+from .map import get_token
 
 log = logging.getLogger(__name__)
 
-token = yaml.safe_load(open(expanduser("~") + "/.mapbox/creds.yaml"))
-
 
 class Twomaps:
     """ containing two maps  """
@@ -30,38 +25,88 @@ class Twomaps:
         self.template = template
 
     def _repr_html_(self):
-        """ display in notebook as iframe """
-        html = self.html().replace('"', "'")
-        iframe = f'<iframe id="mapframe", srcdoc="{html}" style="border: 0" width="100%", height="500px"></iframe>'
-        return iframe
+        """ display in notebook as iframe. see pymapbox.notebook """
+        from .notebook import iframe
+
+        return iframe(self)
 
-    def html(self):
+    def html(self, files="map_files", external=None, compress=False, base=None):
         """ return html page
+        :param files: folder for tiles relative to page
+        :param external: folder of page. if set then sources are saved in external/sources rather than inline.
+        :param compress: also save gzipped copy of external sources
+        :param base: url that relative urls are resolved against. default is location of page.
+        """
+        f = StringIO()
+        self.write(f, files, external, compress, base, stream=False)
+        return f.getvalue()
+
+    def write(
+        self,
+        file,
+        files="map_files",
+        external=None,
+        compress=False,
+        base=None,
+        stream=True,
+    ):
+        """ write html page to open file. parameters as html.
+        :param stream: encode geojson sources as they are written so only one is in memory at a time
         """
-        with tempdir(Path(__file__).parent.parent / "templates"):
-            html = open(self.template).read()
+        from .templates import write
 
-            # use legends and toggles from map1 only
-            self.map1.legends = self.map1.get_legends()
-            self.map1.toggles = self.map1.get_toggles()
+        # use legends and toggles from map1 only
+        self.map1.legends = self.map1.get_legends()
+        self.map1.toggles = self.map1.get_toggles()
+        self.map1.sources = self.map1.get_sources(files, external, compress, stream)
+        self.map2.sources = self.map2.get_sources(files, external, compress, stream)
 
-            # align maps
-            self.map2.center = self.map1.center
-            self.map2.zoom = self.map1.zoom
+        # align maps
+        self.map2.center = self.map1.center
+        self.map2.zoom = self.map1.zoom
 
-            return yatl.render(
-                html,
-                delimiters="[[ ]]",
-                context=dict(token=token, map1=self.map1, map2=self.map2),
-            )
+        token = get_token(self.map1.token)
+        write(
+            file, self.template, token=token, base=base, map1=self.map1, map2=self.map2
+        )
 
-    def save(self, filename):
+    def save(self, filename, external_sources=False, compress=False):
         """ save as html
         :param filename: output filename. default extension is html.
+        :param external_sources: save sources as files that can be cached and shared by other maps
+        :param compress: also save gzipped copy of external sources for servers that support it
+        :return: path of html file
         """
         if not os.path.splitext(filename)[-1]:
             filename = filename + ".html"
         if not filename.find(os.sep) >= 0:
             filename = Path(__file__).parent.parent / "data/output" / filename
+        filename = Path(filename)
+        files = f"{filename.stem}_files"
+        self.save_tiles(filename.parent / files)
+        external = filename.parent if external_sources else None
         with open(filename, "w", encoding="utf8") as f:
-            f.write(self.html())
+            self.write(f, files, external, compress)
+        return filename
+
+    def serve(self, filename="map", port=0):
+        """ save with external sources and serve folder from a local server on a background thread
+        use "pymapbox serve" to serve saved maps from the command line.
+        :param filename: as save
+        :param port: port number. 0 is any free port.
+        :return: url of page
+        """
+        from .server import Server
+
+        filename = self.save(filename, external_sources=True, compress=True)
+        server = Server(filename.parent, port=port).start_thread()
+        url = f"{server.url}/{filename.name}"
+        log.info(f"serving {url}")
+        return url
+
+    def save_tiles(self, path):
+        """ write tiles for tiled sources of both maps
+        :param path: folder for tiles. each source is in subfolder container/name.
+        """
+        self.map1.save_tiles(path)
+        self.map2.save_tiles(path)
@@ -1,21 +1,21 @@
 import contextlib
 import difflib
+import gzip
+import hashlib
 import json
 import logging
 import os
-from functools import partial
-from io import BytesIO
-from multiprocessing import Pool
+import re
+import shutil
+import threading
+from functools import lru_cache
+from pathlib import Path
 from time import sleep
 
-import geopandas as gpd
 import numpy as np
 import pandas as pd
-from fuzzywuzzy import fuzz, process
-from geopy.distance import geodesic
-from scipy.spatial import Voronoi
-from shapely.geometry import MultiPoint, Point, Polygon
-from tqdm.auto import tqdm
+
+from .encode import dumps
 
 log = logging.getLogger(__name__)
 
@@ -33,8 +33,29 @@ def replace_quotes(df):
         except:
             log.warning(f"cannot remove quotes from {col}")
 
-
-def fuzzymerge(df1, df2, key, minscore=None):
+    # categories are replaced once rather than per row
+    for col in [c for c in df if df[c].dtype.name == "category"]:
+        cats = df[col].cat.categories
+        if cats.dtype != object or not cats.str.contains("'").any():
+            continue
+        replaced = cats.str.replace("'", "")
+        if replaced.is_unique:
+            df[col] = df[col].cat.rename_categories(replaced)
+        else:
+            s = df[col].astype(object).str.replace("'", "")
+            df[col] = s.astype("category")
+
+
+def fuzzymerge(
+    df1,
+    df2,
+    key,
+    minscore=None,
+    one_to_one=False,
+    candidates=20,
+    workers=None,
+    table=None,
+):
     """ merges on fuzzy text key
     exact matches first; then unmatched df1 to closest unmatched on df2
     left join that expects zero or one match in df2
@@ -42,6 +63,11 @@ def fuzzymerge(df1, df2, key, minscore=None):
     
     :param key: column to merge on. must be in df1 and df2
     :param minscore: if set then returns only matches above this
+    :param one_to_one: resolve duplicate matches so each df2 key matches at most one df1 key. highest score wins.
+    :param candidates: number of unmatched df2 keys sharing most character trigrams that are scored for each key.
+        None scores all pairs. see fuzzyscores.
+    :param workers: number of processes for scoring. default is this process.
+    :param table: matches.MatchTable to reuse saved and manual matches. table.last shows source of each match.
     :return: merged dataframe. if minscore=None then show scores to identify appropriate minscore cutoff.
 
     e.g. match area names on two data sources such as "Birmingham, West" and "West Birmingham"
@@ -55,14 +81,24 @@ def fuzzymerge(df1, df2, key, minscore=None):
     unmatched2 = merged[merged._merge == "right_only"][key].tolist()
 
     # fuzzy matches. mapper will contain list of tuples (unmatched1, best match, score)
-    mapper = []
-    for v in unmatched1:
-        # returns tuple (best match, score)
-        res = process.extractOne(v, unmatched2)
-        if not res:
-            res = (v, "no match", 0)
-        mapper.append([v, *res])
+    if table is None:
+        scores = fuzzyscores(unmatched1, unmatched2, candidates, minscore or 0, workers)
+    else:
+        scores = table.scores(
+            unmatched1, unmatched2, candidates, minscore or 0, workers
+        )
+    if one_to_one:
+        best = assign(scores)
+    else:
+        # first of highest scores as process.extractOne
+        best = [max(row, key=lambda x: x[1]) if row else None for row in scores]
+    mapper = [
+        [v, unmatched2[b[0]], b[1]] if b else [v, "no match", 0]
+        for v, b in zip(unmatched1, best)
+    ]
     mapper = pd.DataFrame(mapper, columns=[key, "fuzzykey", "fuzzyscore"])
+    if table is not None:
+        table.last = mapper.assign(source=table.sources)
     df1 = df1.merge(mapper, on=key, how="left")
 
     # matched
@@ -73,10 +109,7 @@ def fuzzymerge(df1, df2, key, minscore=None):
     # fuzzy match
     res = df1.merge(df2.rename(columns={key: "fuzzykey"}), on="fuzzykey", how="left")
     fuz = ["fuzzykey", "fuzzyscore"]
-    if minscore is None:
-        # to check what minscore should be
-        res = res.sort_values("fuzzyscore").set_index([key] + fuz)
-    else:
+    if minscore is not None:
         # after setting minscore
         res = res[res.fuzzyscore > minscore]
 
@@ -85,31 +118,143 @@ def fuzzymerge(df1, df2, key, minscore=None):
     if len(dupes) > 0:
         log.warning(f"some duplicate matches\n{dupes}")
 
+    if minscore is None:
+        # to check what minscore should be
+        res = res.sort_values("fuzzyscore").set_index([key] + fuz)
+
     if minscore:
         res = res.drop(fuz, axis=1).set_index(key)
     return res
 
 
+def fuzzyscores(queries, choices, candidates=20, minscore=0, workers=None):
+    """ return fuzzywuzzy scores of each query against its candidate choices
+    scores are as process.extractOne i.e. full_process then WRatio
+
+    :param candidates: number of choices sharing most character trigrams with query that are scored.
+        None scores all pairs.
+    :param minscore: queries whose best candidate scores below this are scored against all choices. 0 uses 100 so
+        the best match is as scoring all pairs. otherwise a best candidate above minscore may not be the best choice.
+    :param workers: number of processes. default is this process.
+    :return: list for each query of [(index of choice, score)] in order of choices
+    """
+    if not queries or not choices:
+        return [[] for _ in queries]
+    if candidates is None or candidates >= len(choices):
+        index = [np.arange(len(choices))] * len(queries)
+    else:
+        index = trigram_candidates(queries, choices, candidates)
+    scores = _score_tasks(
+        [(q, [choices[i] for i in idx]) for q, idx in zip(queries, index)], workers
+    )
+    out = [list(zip(idx.tolist(), row)) for idx, row in zip(index, scores)]
+
+    # score all choices where blocking found nothing good enough. 100 cannot be beaten.
+    recheck = minscore or 100
+    retry = [
+        i
+        for i, row in enumerate(out)
+        if len(index[i]) < len(choices) and max([x[1] for x in row] or [-1]) < recheck
+    ]
+    if retry:
+        scores = _score_tasks([(queries[i], choices) for i in retry], workers)
+        for i, row in zip(retry, scores):
+            out[i] = list(enumerate(row))
+    log.info(
+        f"fuzzy scored {sum(len(row) for row in out)} pairs for {len(queries)} keys; {len(retry)} against all"
+    )
+    return out
+
+
+def trigram_candidates(queries, choices, n):
+    """ return list of arrays of indices of up to n choices that share most character trigrams with each query
+    trigrams are counted in a sparse matrix and ranked in blocks of queries
+    """
+    from fuzzywuzzy.utils import full_process
+    from scipy.sparse import csr_matrix
+
+    vocab = dict()
+
+    def matrix(strings):
+        rows, cols = [], []
+        for i, s in enumerate(strings):
+            s = f"  {full_process(s)} "
+            for gram in {s[j : j + 3] for j in range(len(s) - 2)}:
+                rows.append(i)
+                cols.append(vocab.setdefault(gram, len(vocab)))
+        return rows, cols
+
+    q, c = matrix(queries), matrix(choices)
+    qm = csr_matrix((np.ones(len(q[0])), q), shape=(len(queries), len(vocab)))
+    cm = csr_matrix((np.ones(len(c[0])), c), shape=(len(choices), len(vocab)))
+    qsize = np.asarray(qm.sum(axis=1)).ravel()
+    csize = np.asarray(cm.sum(axis=1)).ravel()
+
+    out = []
+    block = max(1, 2 ** 22 // len(choices))
+    for start in range(0, len(queries), block):
+        shared = (qm[start : start + block] @ cm.T).toarray()
+        # proportion of trigrams shared so long choices are not favoured
+        similarity = shared / (qsize[start : start + block, None] + csize[None, :])
+        top = np.argpartition(-similarity, n - 1, axis=1)[:, :n]
+        for row, idx in zip(shared, top):
+            out.append(np.sort(idx[row[idx] > 0]))
+    return out
+
+
+def assign(scores):
+    """ return best (choice, score) for each query with each choice used at most once
+    pairs are assigned in order of score; queries whose candidates are all taken have None
+    """
+    pairs = sorted(
+        (-score, q, c) for q, row in enumerate(scores) for c, score in row if score > 0
+    )
+    best = [None] * len(scores)
+    used = set()
+    for score, q, c in pairs:
+        if best[q] is None and c not in used:
+            best[q] = (c, -score)
+            used.add(c)
+    return best
+
+
+def _score_tasks(tasks, workers=None):
+    """ return scores for list of (query, choices). split across processes if workers. """
+    if not workers or len(tasks) < 2 * workers:
+        return _score_batch(tasks)
+    from concurrent.futures import ProcessPoolExecutor
+
+    size = -(-len(tasks) // (workers * 4))
+    batches = [tasks[i : i + size] for i in range(0, len(tasks), size)]
+    with ProcessPoolExecutor(workers) as ex:
+        return [row for rows in ex.map(_score_batch, batches) for row in rows]
+
+
+def _score_batch(tasks):
+    """ return list of scores for each choice of each (query, choices) """
+    from fuzzywuzzy import process
+
+    return [
+        [score for _, score in process.extractWithoutOrder(q, choices)]
+        for q, choices in tasks
+    ]
+
+
 def mapply(df, func, **kwargs):
     """ DataFrame.apply using multiprocessing to split across cores
-    :param df: pandas dataframe
+    :param df: pandas dataframe or geodataframe
     :param func: function to apply to df
     :param ncores: number of cores. default cpu_count.
-    :param nsplit: number of splits in dataframe. default cpu_count.
+    :param nsplits: number of splits in dataframe. default from size of data. see parallel.Executor.map.
     :param kwargs: all kwargs not listed above are passed to func
     func is any function and can be tested using basic df.apply
+    workers are kept for later calls. see parallel.
     """
-    ncores = kwargs.pop("ncores", os.cpu_count())
-    nsplits = kwargs.pop("nsplits", os.cpu_count())
-    # partial enables additional parameters as pool.map just accepts iterator
-    func = partial(func, **kwargs)
-    chunks = np.array_split(df, nsplits)
-    pool = Pool(ncores)
-    res = tqdm(pool.map(func, chunks), total=nsplits)
-    df = pd.concat(res)
-    pool.close()
-    pool.join()
-    return df
+    from .parallel import executor
+
+    ncores = kwargs.pop("ncores", None)
+    nsplits = kwargs.pop("nsplits", None)
+    return executor(ncores).map(df, func, nsplits, **kwargs)
 
 
 pd.DataFrame.mapply = mapply
@@ -128,6 +273,44 @@ def tempdir(path):
         os.chdir(saved)
 
 
+def save_hashed(text, path, suffix="", compress=False):
+    """ save text to file named by hash of content. existing file is not rewritten.
+    :param text: str or bytes. or iterable of chunks that are written as they arrive.
+    :param path: folder
+    :param compress: also save gzipped copy as filename.gz
+    :return: filename
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    tmp = path / f"{os.getpid()}.{threading.get_ident()}.tmp"
+    if isinstance(text, (str, bytes)):
+        data = text.encode("utf8") if isinstance(text, str) else text
+        filename = path / f"{hashlib.sha1(data).hexdigest()[:16]}{suffix}"
+        if not filename.exists():
+            tmp.write_bytes(data)
+            os.replace(tmp, filename)
+    else:
+        # name is known only when all chunks are written
+        h = hashlib.sha1()
+        with open(tmp, "wb") as f:
+            for chunk in text:
+                chunk = chunk.encode("utf8") if isinstance(chunk, str) else chunk
+                h.update(chunk)
+                f.write(chunk)
+        filename = path / f"{h.hexdigest()[:16]}{suffix}"
+        if filename.exists():
+            tmp.unlink()
+        else:
+            os.replace(tmp, filename)
+
+    gz = Path(f"{filename}.gz")
+    if compress and not gz.exists():
+        with open(filename, "rb") as src, gzip.open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp, gz)
+    return filename
+
+
 def change_keys(obj, convert=None):
     """
     Recursively replace dict keys
@@ -151,62 +334,223 @@ def change_keys(obj, convert=None):
     return obj
 
 
+def expression_columns(expr):
+    """ return set of feature properties referenced by mapbox expression, filter or style function
+    :return: set of property names. None if any property could be referenced e.g. ["properties"]
+
+    e.g. ["match", ["get", "party"], "LD", "orange", "white"] => {"party"}
+    """
+    cols = set()
+    if isinstance(expr, str):
+        # token string e.g. text-field "{wardname}"
+        cols.update(re.findall(r"{([^{}]+)}", expr))
+    elif isinstance(expr, dict):
+        # legacy style function e.g. dict(property="ratio", stops=[...])
+        if isinstance(expr.get("property"), str):
+            cols.add(expr["property"])
+        for v in expr.values():
+            found = expression_columns(v)
+            if found is None:
+                return None
+            cols |= found
+    elif isinstance(expr, (list, tuple)) and expr:
+        op = expr[0]
+        if op == "properties":
+            return None
+        # computed key e.g. ["get", ["concat", "ratio", "2019"]] could be any property
+        if (
+            op in ["get", "has", "!has"]
+            and len(expr) > 1
+            and not isinstance(expr[1], str)
+        ):
+            return None
+        # expression ["get", key] or legacy filter ["==", key, value]
+        if isinstance(op, str) and len(expr) > 1 and isinstance(expr[1], str):
+            if op in ["get", "has", "!has"] + list(LEGACY_FILTERS):
+                cols.add(expr[1])
+        # first item is an operator unless e.g. stops [[0, "red"], ...]
+        for v in expr[1:] if isinstance(op, str) else expr:
+            found = expression_columns(v)
+            if found is None:
+                return None
+            cols |= found
+    return cols
+
+
+# filter operators where second item is a property name in legacy mapbox filters
+LEGACY_FILTERS = ("==", "!=", ">", ">=", "<", "<=", "in", "!in")
+
+
 # geo utils ###############################################################
 
 
 def geojson(gdf):
-    """ return geojson from geodataframe
-    includes geometry, crs, properties (from other columns)
+    """ return geojson dict from geodataframe
+    includes geometry, properties (from other columns)
+
+    for text use encode.dumps which avoids creating the dict
     """
-    if not isinstance(gdf, gpd.GeoDataFrame):
-        gdf = gpd.GeoDataFrame(gdf)
-    f = BytesIO()
-    gdf.to_file(f, driver="GeoJSON")
+    return json.loads(dumps(gdf))
 
-    return json.loads(f.getvalue())
+
+def simplify(df, tolerance):
+    """ return copy of geodataframe with simplified geometry
+    :param tolerance: maximum distance moved. 0 returns df unchanged.
+    """
+    if not tolerance:
+        return df
+    df = df.copy()
+    df.geometry = df.geometry.simplify(tolerance)
+    return df
 
 
-def get_voronoi(df):
+def get_voronoi(df, boundary=None, tilepoints=None, workers=None):
     """ return df with geometry column set to voronoi region (boundary around each point)
     :param df: geodataframe of points
-    :return: geodataframe of voronoi regions
+    :param boundary: geodataframe or geometry that regions are clipped to e.g. coastline. default is extent of points.
+    :param tilepoints: maximum points per tile for large data. default voronoi.TILEPOINTS.
+    :param workers: number of processes for tiles. default cpu_count.
+    :return: geodataframe of voronoi regions. duplicate points have the same region.
     """
+    from . import voronoi
+
     df = df.copy()
-    points = [(p.x, p.y) for p in df.geometry]
-    # add 4 outer points to ensure all data has a region. otherwise voronoi region is undefined for outermost points.
-    points.extend(
-        list(MultiPoint(points).envelope.buffer(0.2).envelope.exterior.coords)[1:]
-    )
-    vor = Voronoi(points)
-    df["geometry"] = [
-        Polygon(vor.vertices[vor.regions[i]]) for i in vor.point_region[:-4]
-    ]
+    coords = np.column_stack([df.geometry.x, df.geometry.y])
+    bounds = None
+    if boundary is not None:
+        # regions cover the boundary as well as the points
+        b = (
+            boundary.total_bounds
+            if hasattr(boundary, "total_bounds")
+            else boundary.bounds
+        )
+        bounds = voronoi.pad(
+            [
+                *np.minimum(coords.min(axis=0), b[:2]),
+                *np.maximum(coords.max(axis=0), b[2:]),
+            ]
+        )
+    geoms = voronoi.regions(coords, bounds, tilepoints or voronoi.TILEPOINTS, workers)
+    if boundary is not None:
+        geoms = voronoi.clip(geoms, boundary)
+    df["geometry"] = geoms
     return df
 
 
-def points2border(points, area_key):
+def points2border(points, area_key, boundary=None, workers=None):
     """ create area borders from a set of points
     :param points: geodataframe of points
     :param area_key: columns that identify the points in each area
+    :param boundary: geodataframe or geometry that borders are clipped to e.g. coastline
+    :param workers: number of processes for voronoi tiles and dissolve. default cpu_count.
     :return: geodataframe of area boundaries that are contiguous and non-overlapping
 
+    each area is the union of the voronoi regions of its points. only the part with most points is kept. points in
+    other parts and polygon in polygon are removed and only the regions that border them are recalculated. this is
+    the same as a second voronoi of all the points without them.
+    duplicate points in different areas belong to the first area.
+    needs shapely 2. shapely<2 e.g. the version in requirements.txt uses the slower two pass spatial join.
+    """
+    import geopandas as gpd
+
+    try:
+        import shapely
+
+        shapely.get_parts
+    except AttributeError:
+        return _points2border_sjoin(points, area_key)
+    from . import voronoi
+
+    keys = [area_key] if isinstance(area_key, str) else list(area_key)
+    points = points[points.geometry.notna() & ~points.geometry.is_empty]
+    grouped = points.groupby(keys, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    index = grouped.size().index
+
+    # unique points and their area
+    coords = np.column_stack([points.geometry.x, points.geometry.y])
+    coords, inverse = np.unique(coords, axis=0, return_inverse=True)
+    area = np.full(len(coords), len(index))
+    np.minimum.at(area, np.asarray(inverse).ravel(), codes)
+    bounds = voronoi.pad([*coords.min(axis=0), *coords.max(axis=0)])
+    regions = voronoi.regions(coords, bounds, workers=workers)
+
+    # part of area containing each point
+    parts, part_area = shapely.get_parts(
+        dissolve(regions, area, len(index), workers, coverage=True), return_index=True
+    )
+    pt, pp = shapely.STRtree(parts).query(
+        shapely.points(coords), predicate="intersects"
+    )
+    same = part_area[pp] == area[pt]
+    part = np.full(len(coords), -1)
+    part[pt[same]] = pp[same]
+
+    # primary part has most points then largest area
+    npoints = np.bincount(part[part >= 0], minlength=len(parts))
+    order = np.lexsort((-shapely.area(parts), -npoints, part_area))
+    primary = np.zeros(len(parts), dtype=bool)
+    primary[order[np.r_[True, part_area[order][1:] != part_area[order][:-1]]]] = True
+    kept = primary[part] & (part >= 0)
+    log.info(f"{(~kept).sum()} points outside the main part of their area")
+
+    # new regions without the other points for kept points with regions that border them
+    pieces, piece_area = parts[primary], part_area[primary]
+    if not kept.all():
+        holes = shapely.get_parts(shapely.union_all(parts[~primary]))
+        ids = np.flatnonzero(kept)
+        gi, ci = shapely.STRtree(regions[ids]).query(holes, predicate="intersects")
+        order = np.argsort(gi, kind="stable")
+        subsets = np.split(ci[order], np.flatnonzero(np.diff(gi[order])) + 1)
+        updated = voronoi.regions(coords[ids], bounds, workers=workers, subsets=subsets)
+        changed = ids[updated != None]
+        regions = regions.copy()
+        regions[changed] = updated[updated != None]
+
+        # areas with new regions are the union of their regions so shared edges match exactly
+        affected = np.isin(area, area[changed]) & kept
+        same = ~np.isin(piece_area, area[changed])
+        pieces = np.concatenate([pieces[same], regions[affected]])
+        piece_area = np.concatenate([piece_area[same], area[affected]])
+    borders = dissolve(pieces, piece_area, len(index), workers, coverage=True)
+    if boundary is not None:
+        borders = voronoi.clip(borders, boundary)
+
+    return gpd.GeoDataFrame(
+        geometry=gpd.GeoSeries(borders, index=index, crs=points.crs)
+    )
+
+
+def _points2border_sjoin(points, area_key):
+    """ points2border with two global voronoi passes and spatial joins. for shapely<2.
     Defines boundaries based on primary polygons excluding points in secondary polygons and polygon in polygon
     """
+    import geopandas as gpd
+
+    keys = [area_key] if isinstance(area_key, str) else list(area_key)
+
+    def sjoin(left, right):
+        try:
+            return gpd.sjoin(left, right, predicate="contains", how="right")
+        except TypeError:
+            return gpd.sjoin(left, right, op="contains", how="right")
+
     # voronoi pass 1. output includes multipolygons and polygon in polygon.
     voronoi1 = get_voronoi(points)
     borders1 = voronoi1.dissolve(by=area_key)[["geometry"]]
 
     # reduce each area to primary polygon with most points
-    polygons = borders1.reset_index().explode()
-    df = gpd.tools.sjoin(polygons, points, op="contains", how="right")
-    polygons["points"] = df.groupby(["index_left0", "index_left1"]).count().geometry
-    polygons = polygons.sort_values("points", ascending=False).drop_duplicates(area_key)
+    polygons = borders1.reset_index().explode().reset_index(drop=True)
+    polygons["polygon"] = range(len(polygons))
+    df = sjoin(polygons[["polygon", "geometry"]], points)
+    polygons["points"] = df.groupby("polygon").size()
+    polygons = polygons.sort_values("points", ascending=False).drop_duplicates(keys)
 
     # reduce points to those in primary polygon. remove duplicates (polygon in polygon)
-    df = gpd.tools.sjoin(polygons, points, op="contains", how="right")
-    points2 = points.loc[
-        df[(df.pd_x == df.pd_y) & ~df.index.duplicated(keep=False)].index
-    ]
+    primary = polygons[[*keys, "geometry"]].rename(columns={k: f"{k}_p" for k in keys})
+    df = sjoin(primary, points)
+    ok = (df[[f"{k}_p" for k in keys]].to_numpy() == df[keys].to_numpy()).all(axis=1)
+    points2 = points.loc[df[ok & ~df.index.duplicated(keep=False)].index]
 
     # voronoi pass2 excluding outofarea points.
     voronoi2 = get_voronoi(points2)
@@ -215,17 +559,147 @@ def points2border(points, area_key):
     return borders2
 
 
-def km2deg(km, a=(50.8, 2.7)):
-    """ convert km to degrees distance
-    :param a: latitude, longtitude of point. default is Dorset, uk.
+def dissolve(geoms, groups, ngroups=None, workers=None, coverage=False):
+    """ return union of geometries in each group
+    :param groups: integer group of each geometry
+    :param ngroups: length of output. default max group + 1.
+    :param workers: number of processes for large data. default cpu_count.
+    :param coverage: geometries do not overlap and neighbours share edges exactly e.g. voronoi regions. much faster.
+    :return: object array with union for each group or None if there are no geometries
+    large data is split by group across processes. groups split between chunks are joined after.
+    """
+    import geopandas as gpd
+
+    geoms = np.asarray(geoms, dtype=object)
+    groups = np.asarray(groups)
+    if ngroups is None:
+        ngroups = groups.max() + 1 if len(groups) else 0
+    order = np.argsort(groups, kind="stable")
+    df = gpd.GeoDataFrame(
+        dict(group=groups[order]), geometry=gpd.GeoSeries(geoms[order])
+    )
+    if len(df) >= 1000 and workers != 1:
+        df = mapply(
+            df, _union_groups, ncores=workers, progress=False, coverage=coverage
+        )
+        if df.group.duplicated().any():
+            df = _union_groups(df, coverage)
+    else:
+        df = _union_groups(df, coverage)
+    out = np.full(ngroups, None, dtype=object)
+    out[df.group.to_numpy()] = np.asarray(df.geometry.values, dtype=object)
+    return out
+
+
+def _union_groups(df, coverage=False):
+    """ return union per group for dataframe sorted by group """
+    import geopandas as gpd
+    import shapely
+    from shapely.ops import unary_union
+
+    if coverage and hasattr(shapely, "coverage_union_all"):
+        unary_union = shapely.coverage_union_all
+
+    groups = df.group.to_numpy()
+    geoms = np.asarray(df.geometry.values, dtype=object)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    ends = np.r_[starts[1:], len(groups)]
+    unions = [unary_union(geoms[s:e]) for s, e in zip(starts, ends)]
+    index = df.index[starts]
+    return gpd.GeoDataFrame(
+        dict(group=groups[starts]),
+        geometry=gpd.GeoSeries(unions, index=index),
+        index=index,
+    )
+
+
+# default reference point. latitude, longitude of Dorset, uk.
+REFERENCE = (50.8, 2.7)
+
+# wgs84 ellipsoid
+AXIS = 6378.137
+E2 = 0.00669437999014
+
+
+def km_per_deg(lat):
+    """ return km per degree of latitude and of longitude at latitudes. closed form for the wgs84 ellipsoid.
+    :param lat: latitude in degrees. scalar or array.
+    :return: kmy, kmx
     """
+    phi = np.radians(np.asarray(lat, dtype=float))
+    w = 1 - E2 * np.sin(phi) ** 2
+    kmy = np.pi * AXIS * (1 - E2) / (180 * w ** 1.5)
+    kmx = np.pi * AXIS * np.cos(phi) / (180 * np.sqrt(w))
+    return kmy, kmx
+
+
+@lru_cache(maxsize=None)
+def _reference_km(a):
+    """ return km per degree along a diagonal at point a. geodesic if geopy is installed. """
     b = a[0] + 0.1, a[1] + 0.1
-    deg = np.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2)
-    return km * deg / geodesic(a, b).km
+    try:
+        from geopy.distance import geodesic
+    except ImportError:
+        kmy, kmx = km_per_deg(a[0] + 0.05)
+        return float(np.sqrt((kmy ** 2 + kmx ** 2) / 2))
+    return geodesic(a, b).km / np.sqrt(0.02)
+
+
+def _km(a, lat):
+    """ return km per degree along a diagonal at latitudes lat or at reference point a """
+    if lat is None:
+        return _reference_km(tuple(a))
+    kmy, kmx = km_per_deg(lat)
+    return np.sqrt((kmy ** 2 + kmx ** 2) / 2)
+
+
+def km2deg(km, a=REFERENCE, lat=None):
+    """ convert km to degrees distance
+    :param km: scalar or array
+    :param a: latitude, longtitude of reference point used if lat is None. exact value is cached.
+    :param lat: latitude per value. scalar or array.
+    """
+    return km / _km(a, lat)
+
 
+def deg2km(deg, a=REFERENCE, lat=None):
+    """ convert distance from degrees to km. parameters as km2deg. """
+    return deg * _km(a, lat)
 
-def deg2km(deg, a=(50.8, 2.7)):
-    """ convert distance from degrees to km
-    :param a: latitude, longtitude of point. default is Dorset, uk.
+
+def buffer_km(geoms, km, **kwargs):
+    """ return geometries buffered by km
+    longitude is scaled at the latitude of each geometry so the buffer is round on the ground.
+    :param geoms: geoseries in lat/lon
+    :param km: scalar or array per geometry
+    :param kwargs: passed to buffer e.g. resolution
     """
-    return deg / km2deg(1)
+    import geopandas as gpd
+    import shapely
+
+    values = np.asarray(geoms.values, dtype=object)
+    kmy, kmx = km_per_deg(geoms.centroid.y.to_numpy())
+    scale = np.where(np.isfinite(kmx), kmx / kmy, 1.0)
+    distance = np.broadcast_to(np.asarray(km, dtype=float) / kmy, len(values))
+
+    if hasattr(shapely, "get_coordinates"):
+        coords, index = shapely.get_coordinates(values, return_index=True)
+        coords[:, 0] *= scale[index]
+        scaled = shapely.set_coordinates(values.copy(), coords)
+        buffered = shapely.buffer(scaled, distance, **kwargs)
+        coords, index = shapely.get_coordinates(buffered, return_index=True)
+        coords[:, 0] /= scale[index]
+        buffered = shapely.set_coordinates(buffered, coords)
+    else:
+        from shapely.affinity import scale as affine
+
+        buffered = [
+            affine(
+                affine(g, s, 1, origin=(0, 0)).buffer(d, **kwargs),
+                1 / s,
+                1,
+                origin=(0, 0),
+            )
+            for g, s, d in zip(values, scale, distance)
+        ]
+    return gpd.GeoSeries(buffered, index=geoms.index, crs=geoms.crs)
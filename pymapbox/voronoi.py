@@ -0,0 +1,426 @@
+""" voronoi regions of points
+
+* coordinates are taken from the geometry column as arrays and polygons are built in bulk
+* regions are clipped to the extent of the points or to a boundary such as a coastline using a spatial index
+* duplicate points share one region
+* large inputs are split into spatial tiles that can run in parallel. each tile includes a halo of neighbouring
+  points. a region is accepted if no other point is nearer to any of its vertices than its own point.
+  other regions are recalculated with the points that could change them so tiled output is the same as untiled.
+"""
+
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# points per tile
+TILEPOINTS = 250000
+
+# extent of regions beyond the points as a proportion of the extent of the points
+PAD = 0.1
+
+# nearest points included with each point of a subset
+NEAREST = 24
+
+# boundary parts are split so each piece has at most this many vertices
+MAXVERTICES = 256
+
+
+def regions(coords, bounds=None, tilepoints=TILEPOINTS, workers=None, subsets=None):
+    """ return voronoi region for each point
+    :param coords: array of x, y (n, 2)
+    :param bounds: (minx, miny, maxx, maxy) that regions are clipped to. default is extent of points plus PAD.
+    :param tilepoints: maximum points per tile
+    :param workers: number of processes when there is more than one tile. default cpu_count.
+    :param subsets: list of arrays of indices of points. only their regions are calculated, each array as one tile.
+        regions are the same as when calculated for all points with the same bounds.
+    :return: object array of polygons. duplicate points have the same region. None if not in subsets.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if not len(coords):
+        return np.empty(0, dtype=object)
+    points, inverse = np.unique(coords, axis=0, return_inverse=True)
+    if bounds is None:
+        bounds = pad([*points.min(axis=0), *points.max(axis=0)])
+
+    # outer points far enough that no region within bounds is changed but all regions are finite
+    minx, miny, maxx, maxy = bounds
+    far = 3 * max(maxx - minx, maxy - miny, 1e-9)
+    frame = np.array(
+        [
+            [minx - far, miny - far],
+            [maxx + far, miny - far],
+            [maxx + far, maxy + far],
+            [minx - far, maxy + far],
+        ]
+    )
+
+    inverse = np.asarray(inverse).ravel()
+    if subsets is None:
+        ids, counts, rings = _tiled(
+            points, bounds, frame, _tiles(points, tilepoints), workers
+        )
+    else:
+        # nearest points are almost always enough. regions are then checked exactly.
+        from scipy.spatial import cKDTree
+
+        tiles = [np.unique(inverse[s]) for s in subsets if len(s)]
+        tree = cKDTree(points)
+        k = min(NEAREST, len(points))
+        near = [np.unique(tree.query(points[t], k)[1]) for t in tiles]
+        ids, counts, rings = _tiled(points, bounds, frame, tiles, workers, near)
+    out = np.full(len(points), None, dtype=object)
+    out[ids] = polygons(rings, counts)
+    return out[inverse]
+
+
+def clip(geoms, boundary, maxvertices=MAXVERTICES):
+    """ return geometries intersected with boundary. None if outside.
+    geometries within a boundary part are unchanged. others are intersected with pieces of the boundary found via
+    a spatial index so large boundaries such as coastlines are not intersected whole.
+
+    :param geoms: sequence of polygons
+    :param boundary: geodataframe, geoseries, list of geometries or geometry
+    """
+    import shapely
+
+    geoms = np.asarray(geoms, dtype=object)
+    if hasattr(boundary, "geometry"):
+        boundary = boundary.geometry
+    if hasattr(boundary, "geom_type") and not hasattr(boundary, "__len__"):
+        boundary = [boundary]
+    boundary = [b for b in boundary if b is not None and not b.is_empty]
+
+    if not hasattr(shapely, "STRtree") or not hasattr(shapely, "get_parts"):
+        return _clip_loop(geoms, boundary)
+
+    # unchanged if within a part
+    parts = shapely.get_parts(np.asarray(boundary, dtype=object))
+    shapely.prepare(parts)
+    out = np.full(len(geoms), None, dtype=object)
+    valid = np.flatnonzero(~shapely.is_missing(geoms))
+    within = shapely.STRtree(parts).query(geoms[valid], predicate="within")[0]
+    out[valid[within]] = geoms[valid[within]]
+
+    # intersect the rest with pieces
+    rest = np.setdiff1d(valid, valid[within])
+    pieces = subdivide(parts, maxvertices)
+    gi, pi = shapely.STRtree(pieces).query(geoms[rest], predicate="intersects")
+    if not len(gi):
+        return out
+    parts = shapely.intersection(geoms[rest[gi]], pieces[pi])
+    order = np.argsort(gi, kind="stable")
+    gi, parts = gi[order], parts[order]
+    starts = np.flatnonzero(np.r_[True, gi[1:] != gi[:-1]])
+    ends = np.r_[starts[1:], len(gi)]
+    single = ends - starts == 1
+    out[rest[gi[starts[single]]]] = parts[starts[single]]
+    for s, e in zip(starts[~single].tolist(), ends[~single].tolist()):
+        out[rest[gi[s]]] = shapely.union_all(parts[s:e])
+    return out
+
+
+def subdivide(parts, maxvertices=MAXVERTICES):
+    """ return geometries split into quarters until each has at most maxvertices """
+    import shapely
+
+    done = []
+    todo = np.asarray(parts, dtype=object)
+    while len(todo):
+        big = shapely.get_num_coordinates(todo) > maxvertices
+        done.append(todo[~big])
+        todo = todo[big]
+        if not len(todo):
+            break
+        b = shapely.bounds(todo)
+        mx = (b[:, 0] + b[:, 2]) / 2
+        my = (b[:, 1] + b[:, 3]) / 2
+        quarters = [
+            shapely.clip_by_rect(todo[i], *q)
+            for i, (x0, y0, x1, y1, x, y) in enumerate(zip(*b.T, mx, my))
+            for q in [(x0, y0, x, y), (x, y0, x1, y), (x0, y, x, y1), (x, y, x1, y1)]
+        ]
+        todo = np.array(quarters, dtype=object)
+        todo = todo[~shapely.is_empty(todo)]
+    return np.concatenate(done)
+
+
+def pad(bounds, proportion=PAD):
+    """ return bounds extended by proportion of the larger side """
+    minx, miny, maxx, maxy = bounds
+    d = proportion * max(maxx - minx, maxy - miny) or 1
+    return minx - d, miny - d, maxx + d, maxy + d
+
+
+def cells(points, n):
+    """ return (vertices, counts) of voronoi regions of the first n points. all must be inside the convex hull.
+    vertices are the circumcentres of the delaunay triangles around each point in anticlockwise order.
+    this is faster than scipy.spatial.Voronoi which also builds ridges and python lists of regions.
+    """
+    from scipy.spatial import Delaunay
+
+    simplices = Delaunay(points).simplices
+
+    # corners sorted by x then y so a circumcentre is exactly the same in any triangulation e.g. other tiles
+    xy = points[simplices]
+    o = np.argsort(xy[:, :, 1], axis=1, kind="stable")
+    x = np.take_along_axis(xy[:, :, 0], o, axis=1)
+    o = np.take_along_axis(o, np.argsort(x, axis=1, kind="stable"), axis=1)
+    xy = np.take_along_axis(xy, o[:, :, None], axis=1)
+
+    # circumcentres relative to first corner for precision
+    a = xy[:, 0]
+    b = xy[:, 1] - a
+    c = xy[:, 2] - a
+    bb = (b ** 2).sum(axis=1)
+    cc = (c ** 2).sum(axis=1)
+    d = 2 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+    centres = a + np.column_stack(
+        [(c[:, 1] * bb - b[:, 1] * cc) / d, (b[:, 0] * cc - c[:, 0] * bb) / d]
+    )
+
+    # triangles around each point sorted by angle
+    point = simplices.ravel()
+    centre = np.repeat(np.arange(len(simplices)), 3)
+    keep = point < n
+    point, centre = point[keep], centre[keep]
+    v = centres[centre] - points[point]
+    order = np.lexsort((np.arctan2(v[:, 1], v[:, 0]), point))
+    point, vertices = point[order], centres[centre[order]]
+
+    # cocircular points have the same circumcentre more than once
+    keep = np.ones(len(point), dtype=bool)
+    keep[1:] = (point[1:] != point[:-1]) | (vertices[1:] != vertices[:-1]).any(axis=1)
+    return vertices[keep], np.bincount(point[keep], minlength=n)
+
+
+def polygons(rings, counts):
+    """ return object array of polygons from exterior ring coordinates
+    :param rings: coordinates of all rings (n, 2)
+    :param counts: number of coordinates per ring
+    """
+    try:
+        import shapely
+
+        if hasattr(shapely, "linearrings"):
+            index = np.repeat(np.arange(len(counts)), counts)
+            return shapely.polygons(shapely.linearrings(rings, indices=index))
+    except ImportError:
+        pass
+    from shapely.geometry import Polygon
+
+    out = np.empty(len(counts), dtype=object)
+    out[:] = [Polygon(r) for r in np.split(rings, np.cumsum(counts)[:-1])]
+    return out
+
+
+def _tiled(points, bounds, frame, tiles, workers, near=None):
+    """ return ids, counts, ring coordinates of regions for points in tiles
+    :param near: list of points to include with each tile. default is points within a halo.
+    """
+    lo, hi = points.min(axis=0), points.max(axis=0)
+    xorder = np.argsort(points[:, 0], kind="stable")
+    xsorted = points[xorder, 0]
+
+    # (points in tile, nearby points or None to select by halo, halo bounds)
+    pending = []
+    for i, inner in enumerate(tiles):
+        if near is not None:
+            # empty halo so all regions are checked exactly
+            pending.append(
+                (inner, near[i], np.array([np.inf, np.inf, -np.inf, -np.inf]))
+            )
+            continue
+        x0, y0, x1, y1 = (*points[inner].min(axis=0), *points[inner].max(axis=0))
+        m = _margin(inner, (x0, y0, x1, y1))
+        pending.append((inner, None, np.array([x0 - m, y0 - m, x1 + m, y1 + m])))
+    if len(pending) > 1:
+        log.info(f"voronoi of {len(points)} points in {len(pending)} tiles")
+
+    results = []
+    tree = None
+    while pending:
+        tasks = []
+        for inner, near, halo in pending:
+            if near is None:
+                first = np.searchsorted(xsorted, halo[0], side="left")
+                last = np.searchsorted(xsorted, halo[2], side="right")
+                near = xorder[first:last]
+                near = near[(points[near, 1] >= halo[1]) & (points[near, 1] <= halo[3])]
+            near = np.setdiff1d(near, inner, assume_unique=True)
+            # sides beyond the extent of all points have nothing outside
+            halo = halo.copy()
+            halo[:2][halo[:2] <= lo] = -np.inf
+            halo[2:][halo[2:] >= hi] = np.inf
+            subset = np.concatenate([points[inner], points[near], frame])
+            tasks.append((subset, len(inner), bounds, halo))
+
+        if workers == 1 or len(tasks) == 1:
+            done = list(map(_task, tasks))
+        else:
+            workers = workers or os.cpu_count()
+            # small tasks e.g. subsets are sent in batches
+            chunksize = max(1, len(tasks) // (workers * 4))
+            with ProcessPoolExecutor(workers) as ex:
+                done = list(ex.map(_task, tasks, chunksize=chunksize))
+        retry = []
+        for (inner, _, _), (ok, counts, rings) in zip(pending, done):
+            index = np.repeat(np.arange(len(inner)), counts)
+            if not ok.all():
+                # exact check. no point is nearer to any vertex than the point of the region.
+                if tree is None:
+                    from scipy.spatial import cKDTree
+
+                    tree = cKDTree(points)
+                bad = ~ok[index]
+                v = rings[bad]
+                r = np.hypot(*(v - points[inner[index[bad]]]).T)
+                nearer = tree.query(v)[0] < r * (1 - 1e-9)
+                ok[index[bad]] = True
+                ok[index[bad][nearer]] = False
+            results.append((inner[ok], counts[ok], rings[ok[index]]))
+            if not ok.all():
+                # only points within the circles can change these regions so they are exact next time
+                bad = ~ok[index]
+                v = rings[bad]
+                r = np.hypot(*(v - points[inner[index[bad]]]).T)
+                near = tree.query_ball_point(v, r * (1 + 1e-9))
+                near = np.unique(np.fromiter(chain.from_iterable(near), dtype=np.int64))
+                everywhere = np.array([-np.inf, -np.inf, np.inf, np.inf])
+                retry.append((inner[~ok], near, everywhere))
+        if retry:
+            log.info(f"voronoi {sum(len(r[0]) for r in retry)} regions with wider halo")
+        pending = retry
+
+    ids = np.concatenate([r[0] for r in results])
+    counts = np.concatenate([r[1] for r in results])
+    rings = np.concatenate([r[2] for r in results])
+    # reorder by point
+    order = np.argsort(ids, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[order]
+    index = np.repeat(starts, counts[order]) + _within(counts[order])
+    return ids[order], counts[order], rings[index]
+
+
+def _tiles(points, tilepoints):
+    """ return list of point indices per tile. columns split on x then rows on y with equal numbers of points. """
+    n = len(points)
+    ntiles = math.ceil(n / tilepoints)
+    if ntiles <= 1:
+        return [np.arange(n)]
+    ncols = math.ceil(math.sqrt(ntiles))
+    nrows = math.ceil(ntiles / ncols)
+    tiles = []
+    for col in np.array_split(np.argsort(points[:, 0], kind="stable"), ncols):
+        col = col[np.argsort(points[col, 1], kind="stable")]
+        tiles.extend(np.sort(t) for t in np.array_split(col, nrows))
+    return tiles
+
+
+def _margin(inner, box):
+    """ initial halo distance. a few times the average spacing of points. """
+    x0, y0, x1, y1 = box
+    area = (x1 - x0) * (y1 - y0) or max(x1 - x0, y1 - y0) ** 2 or 1
+    return 4 * math.sqrt(area / len(inner))
+
+
+def _within(counts):
+    """ return position of each item within its group e.g. [2, 3] => [0, 1, 0, 1, 2] """
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.arange(counts.sum()) - starts
+
+
+def _task(task):
+    """ return (ok, counts, rings) for the first ninner points. ok if the region is certainly not changed by points
+    outside the halo.
+    :param task: (points, ninner, bounds, halo) where points are inner points then halo points then frame
+    """
+    import shapely
+
+    points, ninner, bounds, halo = task
+    vertices, counts = cells(points, ninner)
+    geoms = polygons(vertices, counts)
+    if hasattr(shapely, "clip_by_rect"):
+        geoms = shapely.clip_by_rect(geoms, *bounds)
+        rings, index = shapely.get_coordinates(
+            shapely.get_exterior_ring(geoms), return_index=True
+        )
+    else:
+        from shapely.geometry import box
+
+        frame = box(*bounds)
+        geoms = [frame.intersection(g) for g in geoms]
+        rings = [np.asarray(g.exterior.coords) for g in geoms]
+        index = np.repeat(np.arange(ninner), [len(r) for r in rings])
+        rings = np.concatenate(rings)
+
+    rings = _snap(rings, index, points, bounds)
+
+    # accepted if the circle around each vertex through the point is within the halo
+    p = points[index]
+    r = np.hypot(*(rings - p).T)
+    outside = (
+        (rings[:, 0] - r < halo[0])
+        | (rings[:, 1] - r < halo[1])
+        | (rings[:, 0] + r > halo[2])
+        | (rings[:, 1] + r > halo[3])
+    )
+    ok = np.bincount(index[outside], minlength=ninner) == 0
+    return ok, np.bincount(index, minlength=ninner), rings
+
+
+def _snap(rings, index, points, bounds):
+    """ return vertices where an edge was clipped by bounds calculated from the two points either side of the edge.
+    so neighbouring regions calculated in other tiles meet exactly.
+    """
+    from scipy.spatial import cKDTree
+
+    x0, y0, x1, y1 = bounds
+    onx = (rings[:, 0] == x0) | (rings[:, 0] == x1)
+    ony = (rings[:, 1] == y0) | (rings[:, 1] == y1)
+    edge = onx ^ ony
+    if not edge.any():
+        return rings
+    v = rings[edge]
+    own = index[edge]
+    nearest = cKDTree(points).query(v, k=2)[1]
+    other = np.where(nearest[:, 0] == own, nearest[:, 1], nearest[:, 0])
+
+    # bisector through midpoint perpendicular to pair sorted by x then y
+    a, b = points[own], points[other]
+    swap = (b[:, 0] < a[:, 0]) | ((b[:, 0] == a[:, 0]) & (b[:, 1] < a[:, 1]))
+    a, b = np.where(swap[:, None], b, a), np.where(swap[:, None], a, b)
+    m = (a + b) / 2
+    d = b - a
+    new = v.copy()
+    fixed = onx[edge] & (d[:, 1] != 0)
+    new[fixed, 1] = (
+        m[fixed, 1] - d[fixed, 0] * (v[fixed, 0] - m[fixed, 0]) / d[fixed, 1]
+    )
+    fixed = ony[edge] & (d[:, 0] != 0)
+    new[fixed, 0] = (
+        m[fixed, 0] - d[fixed, 1] * (v[fixed, 1] - m[fixed, 1]) / d[fixed, 0]
+    )
+    rings = rings.copy()
+    rings[edge] = new
+    return rings
+
+
+def _clip_loop(geoms, boundary):
+    """ clip for shapely<2 """
+    from shapely.ops import unary_union
+    from shapely.prepared import prep
+
+    b = unary_union(boundary)
+    prepared = prep(b)
+    out = np.full(len(geoms), None, dtype=object)
+    for i, g in enumerate(geoms):
+        if g is None or not prepared.intersects(g):
+            continue
+        out[i] = g if prepared.contains(g) else g.intersection(b)
+    return out
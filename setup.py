@@ -21,6 +21,7 @@ params = dict(
 
 ########## EDIT BELOW THIS LINE ONLY ##########
 
+params["entry_points"] = dict(console_scripts=["pymapbox=pymapbox.cli:main"])
 
 ########## EDIT ABOVE THIS LINE ONLY ##########
 
@@ -3,13 +3,195 @@
 ]]
 mapboxgl.accessToken = '[[=token]]';
 
+// add source to map. tile urls are relative to the page or base.
+function addSource(map, name, source) {
+    if (source.tiles) {
+        var base = document.baseURI.replace(/[^\/]*$/, '');
+        source.tiles = source.tiles.map(function (url) {
+            return /^[a-z]+:/.test(url) ? url : base + url;
+        });
+    }
+    // binary source is added empty and data set when decoded
+    if (source.binary) {
+        var binary = source.binary;
+        delete source.binary;
+        source.data = { type: 'FeatureCollection', features: [] };
+        decodeBinary(binary, function (geojson) {
+            map.getSource(name).setData(geojson);
+        });
+    }
+    map.addSource(name, source);
+}
+
+// timeseries layer. data for selected period is set as feature state of the geometry.
+function addTimeseries(map, name, ts) {
+    var id = map.getContainer().id + '_' + name + '_period';
+    function show(i) {
+        var period = ts.periods[i];
+        for (var k = 0; k < ts.keys.length; k++) {
+            var state = {};
+            for (var col in ts.columns) {
+                var c = ts.columns[col], v = c.data[period][k];
+                state[col] = c.values ? (v < 0 ? null : c.values[v]) : v;
+            }
+            ts.sources.forEach(function (source) {
+                map.setFeatureState({ source: source, id: ts.keys[k] }, state);
+            });
+        }
+        $('#' + id + ' span').text(period);
+    }
+    var slider = $('<div class="period" id="' + id + '"><label>' + name + ' <span></span></label></div>');
+    $('<input type="range" min="0" step="1">')
+        .attr('max', ts.periods.length - 1)
+        .val(ts.period)
+        .on('input', function () {
+            show(+this.value);
+        })
+        .appendTo(slider);
+    $('#rightblock').prepend(slider);
+    show(ts.period);
+}
+
+// decode binary source to geojson in a web worker. binary is base64 or url of .bin file.
+var decoder;
+function decodeBinary(binary, callback) {
+    if (!decoder) {
+        var code = '(' + binaryWorker.toString() + ')()';
+        var url = URL.createObjectURL(new Blob([code], { type: 'text/javascript' }));
+        decoder = { worker: new Worker(url), callbacks: {}, next: 0 };
+        decoder.worker.onmessage = function (e) {
+            decoder.callbacks[e.data.id](e.data.geojson);
+            delete decoder.callbacks[e.data.id];
+        };
+    }
+    var id = decoder.next++;
+    decoder.callbacks[id] = callback;
+    decoder.worker.postMessage({ id: id, binary: binary, base: document.baseURI });
+}
+
+// worker code. format is described in pymapbox.binary.
+function binaryWorker() {
+    var TYPES = ['Point', 'LineString', 'LineString', 'Polygon', 'MultiPoint', 'MultiLineString', 'MultiPolygon'];
+
+    function varints(bytes, start, length) {
+        var values = new Float64Array(length), n = 0, value = 0, scale = 1;
+        for (var i = start; i < start + length; i++) {
+            value += (bytes[i] & 0x7f) * scale;
+            if (bytes[i] & 0x80) {
+                scale *= 128;
+            } else {
+                values[n++] = value;
+                value = 0;
+                scale = 1;
+            }
+        }
+        return values.subarray(0, n);
+    }
+
+    function unzigzag(v) {
+        return v % 2 ? -(v + 1) / 2 : v / 2;
+    }
+
+    function decode(buffer) {
+        var bytes = new Uint8Array(buffer);
+        var view = new DataView(buffer);
+        var size = view.getUint32(4, true);
+        var header = JSON.parse(new TextDecoder().decode(bytes.subarray(8, 8 + size)));
+        var start = 8 + size;
+        function buf(name) {
+            var b = header.buffers[name];
+            return varints(bytes, start + b[0], b[1]);
+        }
+        var types = buf('types'), geoms = buf('geoms'), parts = buf('parts'), rings = buf('rings');
+
+        // coordinates are deltas from previous
+        var deltas = buf('coords'), scale = Math.pow(10, header.precision);
+        var coords = new Array(deltas.length / 2), x = 0, y = 0;
+        for (var i = 0; i < coords.length; i++) {
+            x += unzigzag(deltas[2 * i]);
+            y += unzigzag(deltas[2 * i + 1]);
+            coords[i] = [x / scale, y / scale];
+        }
+
+        // property columns
+        var columns = header.properties.map(function (prop, j) {
+            var b = header.buffers['p' + j];
+            if (prop.type == 'float') {
+                var values = new Array(b[1] / 8);
+                for (var i = 0; i < values.length; i++) {
+                    var v = view.getFloat64(start + b[0] + 8 * i, true);
+                    values[i] = isFinite(v) ? v : null;
+                }
+                return values;
+            }
+            var raw = varints(bytes, start + b[0], b[1]);
+            if (prop.type == 'int') {
+                return Array.from(raw, unzigzag);
+            }
+            return Array.from(raw, function (code) {
+                return code ? prop.values[code - 1] : null;
+            });
+        });
+
+        // features. nested as parts => rings => coords.
+        var features = new Array(header.n), c = 0, r = 0, p = 0;
+        for (var i = 0; i < header.n; i++) {
+            var nested = [];
+            for (var k = 0; k < geoms[i]; k++, p++) {
+                var part = [];
+                for (var m = 0; m < parts[p]; m++, r++) {
+                    part.push(coords.slice(c, c + rings[r]));
+                    c += rings[r];
+                }
+                nested.push(part);
+            }
+            var t = types[i] - 1, geometry = null;
+            if (t >= 0 && nested.length) {
+                var cs;
+                if (t == 0) cs = nested[0][0][0];
+                else if (t < 3) cs = nested[0][0];
+                else if (t == 3) cs = nested[0];
+                else if (t == 4) cs = nested.map(function (q) { return q[0][0]; });
+                else if (t == 5) cs = nested.map(function (q) { return q[0]; });
+                else cs = nested;
+                geometry = { type: TYPES[t], coordinates: cs };
+            }
+            var properties = {};
+            for (var j = 0; j < columns.length; j++) {
+                properties[header.properties[j].name] = columns[j][i];
+            }
+            features[i] = { type: 'Feature', properties: properties, geometry: geometry };
+        }
+        return { type: 'FeatureCollection', features: features };
+    }
+
+    self.onmessage = function (e) {
+        var binary = e.data.binary;
+        var loaded;
+        if (/\.bin$/.test(binary)) {
+            loaded = fetch(new URL(binary, e.data.base)).then(function (r) {
+                return r.arrayBuffer();
+            });
+        } else {
+            var text = atob(binary), bytes = new Uint8Array(text.length);
+            for (var i = 0; i < text.length; i++) {
+                bytes[i] = text.charCodeAt(i);
+            }
+            loaded = Promise.resolve(bytes.buffer);
+        }
+        loaded.then(function (buffer) {
+            self.postMessage({ id: e.data.id, geojson: decode(buffer) });
+        });
+    };
+}
+
 var map1 = new mapboxgl.Map(
     [[=XML(map1.root())]]
 );
 map1.on('load', function () {
     // sources
     [[for k, v in map1.sources.items():]]
-    map1.addSource('[[=k]]', [[=XML(v)]]);
+    addSource(map1, '[[=k]]', [[=XML(v)]]);
     [[pass]]
 
     // layers
@@ -17,11 +199,18 @@ map1.on('load', function () {
     map1.addLayer([[=XML(json.dumps(layer))]]);
     [[pass]]
 
-    // toggle layer/legend
-    for (layerid of [[=XML([layer["id"] for layer in map1.layers])]]) {
+    // timeseries
+    [[for k, v in map1.get_timeseries().items():]]
+    addTimeseries(map1, '[[=k]]', [[=XML(v)]]);
+    [[pass]]
+
+    // toggle layer/legend. group is all zoom bands of a layer.
+    var groups = [[=XML(json.dumps(map1.get_groups()))]];
+    for (layerid in groups) {
     $("#" + layerid).change(function (e) {
-        map1.setLayoutProperty(e.target.id, 'visibility', e.target.checked ? 'visible' : 'none'
-        );
+        for (id of groups[e.target.id]) {
+            map1.setLayoutProperty(id, 'visibility', e.target.checked ? 'visible' : 'none');
+        }
         $("#" + e.target.id + "_legend").toggle()
     });
     // end for
@@ -4,7 +4,7 @@ var map2 = new mapboxgl.Map(
 map2.on('load', function () {
     // sources
     [[for k, v in map2.sources.items():]]
-    map2.addSource('[[=k]]', [[=XML(v)]]);
+    addSource(map2, '[[=k]]', [[=XML(v)]]);
     [[pass]]
 
     // layers
@@ -12,12 +12,20 @@ map2.on('load', function () {
     map2.addLayer([[=XML(json.dumps(layer))]]);
     [[pass]]
 
+    // timeseries
+    [[for k, v in map2.get_timeseries().items():]]
+    addTimeseries(map2, '[[=k]]', [[=XML(v)]]);
+    [[pass]]
+
     // show/hide map1 layer and legend
-    for (layerid of [[=XML([layer["id"] for layer in map1.layers])]]) {
+    var groups = [[=XML(json.dumps(map1.get_groups()))]];
+    for (layerid in groups) {
     // When the checkbox changes, update the visibility of the layer and legend
     $("#" + layerid).change(function (e) {
-        map1.setLayoutProperty(e.target.id, 'visibility', e.target.checked ? 'visible' : 'none');
-        map2.setLayoutProperty(e.target.id, 'visibility', e.target.checked ? 'visible' : 'none');
+        for (id of groups[e.target.id]) {
+            map1.setLayoutProperty(id, 'visibility', e.target.checked ? 'visible' : 'none');
+            map2.setLayoutProperty(id, 'visibility', e.target.checked ? 'visible' : 'none');
+        }
         $("#" + e.target.id + "_legend").toggle()
     });
     // end for
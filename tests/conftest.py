@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def gdf():
+    """ geodataframe with each geometry type, missing values and the usual column types """
+    gpd = pytest.importorskip("geopandas")
+    from shapely.geometry import (
+        LineString,
+        MultiLineString,
+        MultiPoint,
+        MultiPolygon,
+        Point,
+        Polygon,
+    )
+
+    hole = [(0.2, 0.2), (0.4, 0.2), (0.4, 0.4), (0.2, 0.2)]
+    square = [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+    geoms = [
+        Point(-1.7083, 52.1917),
+        LineString([(0, 0), (1.5, 2.25), (3, -1)]),
+        Polygon(square, [hole]),
+        MultiPoint([(1, 2), (3, 4)]),
+        MultiLineString([[(0, 0), (1, 1)], [(2, 2), (3, 3)]]),
+        MultiPolygon([Polygon(square), Polygon([(2, 2), (3, 2), (3, 3), (2, 2)])]),
+        None,
+    ]
+    n = len(geoms)
+    return gpd.GeoDataFrame(
+        dict(
+            name=["a", "Jane's", 'quote "x"', "ünï", "", "b", "c"],
+            count=np.arange(n),
+            ratio=[0.5, np.nan, 1e-7, -2.25, 3.0, np.inf, 1 / 3],
+            flag=[True, False] * 3 + [True],
+            party=pd.Categorical(["LD", "C", None, "LD", "Lab", "C", "LD"]),
+            nullable=pd.array([1, None, 3, 4, None, 6, 7], dtype="Int64"),
+        ),
+        geometry=geoms,
+        crs="epsg:4326",
+    )
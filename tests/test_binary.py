@@ -0,0 +1,124 @@
+""" binary sources decode to the same geojson as encode.dumps. decoder follows static/map.js. """
+
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pymapbox import binary, encode
+
+TYPES = ["Point", "LineString", "LineString", "Polygon"]
+TYPES += ["MultiPoint", "MultiLineString", "MultiPolygon"]
+
+
+def varints(data):
+    values, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value, shift = 0, 0
+    return values
+
+
+def unzigzag(v):
+    return -(v + 1) // 2 if v % 2 else v // 2
+
+
+def decode(data):
+    """ return geojson dict from binary """
+    assert data[:4] == binary.MAGIC
+    (size,) = struct.unpack("<I", data[4:8])
+    header = json.loads(data[8 : 8 + size])
+    start = 8 + size
+
+    def buffer(name):
+        offset, length = header["buffers"][name]
+        return data[start + offset : start + offset + length]
+
+    types, geoms, parts, rings = [
+        varints(buffer(k)) for k in ["types", "geoms", "parts", "rings"]
+    ]
+    deltas = np.array([unzigzag(v) for v in varints(buffer("coords"))])
+    xy = np.cumsum(deltas.reshape(-1, 2), axis=0)
+    coords = (xy / 10 ** header["precision"]).tolist()
+
+    columns = []
+    for j, prop in enumerate(header["properties"]):
+        raw = buffer(f"p{j}")
+        if prop["type"] == "float":
+            values = np.frombuffer(raw, "<f8").tolist()
+            columns.append([v if np.isfinite(v) else None for v in values])
+        elif prop["type"] == "int":
+            columns.append([unzigzag(v) for v in varints(raw)])
+        else:
+            columns.append([prop["values"][c - 1] if c else None for c in varints(raw)])
+
+    out = []
+    c = r = p = 0
+    for i in range(header["n"]):
+        nested = []
+        for _ in range(geoms[i]):
+            part = []
+            for _ in range(parts[p]):
+                part.append(coords[c : c + rings[r]])
+                c += rings[r]
+                r += 1
+            nested.append(part)
+            p += 1
+        t = types[i] - 1
+        geometry = None
+        if t >= 0 and nested:
+            cs = [
+                nested[0][0][0],
+                nested[0][0],
+                nested[0][0],
+                nested[0],
+                [q[0][0] for q in nested],
+                [q[0] for q in nested],
+                nested,
+            ][t]
+            geometry = dict(type=TYPES[t], coordinates=cs)
+        properties = {
+            prop["name"]: col[i] for prop, col in zip(header["properties"], columns)
+        }
+        out.append(dict(type="Feature", properties=properties, geometry=geometry))
+    return dict(type="FeatureCollection", features=out)
+
+
+def close(a, b):
+    """ compare nested json with coordinates equal to rounding error """
+    if isinstance(a, float) or isinstance(b, float):
+        return a == pytest.approx(b, abs=1e-12)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(close(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(close(a[k], b[k]) for k in a)
+    return a == b
+
+
+@pytest.mark.parametrize("precision", [None, 2, 0])
+def test_roundtrip(gdf, precision):
+    data = binary.dumps(gdf, precision=precision)
+    if precision is None:
+        precision = binary.PRECISION
+    expected = encode.dumps(gdf, precision=precision)
+    assert close(decode(data), json.loads(expected))
+
+
+def test_empty(gdf):
+    data = binary.dumps(gdf.iloc[:0])
+    assert decode(data)["features"] == []
+
+
+def test_large_values():
+    """ varints and zigzag of large and negative ints """
+    n = np.array([0, 1, -1, 63, -64, 2 ** 31, -(2 ** 40), 2 ** 62])
+    assert [unzigzag(v) for v in varints(binary.varints(binary.zigzag(n)))] == list(n)
+    df = pd.DataFrame(dict(n=n, geometry=[None] * len(n)))
+    props = [f["properties"]["n"] for f in decode(binary.dumps(df))["features"]]
+    assert props == list(n)
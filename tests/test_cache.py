@@ -0,0 +1,70 @@
+""" fingerprint changes with any value, type or option that changes the output """
+
+import numpy as np
+import pandas as pd
+
+from pymapbox import cache
+
+
+def test_same(gdf):
+    assert cache.fingerprint(gdf) == cache.fingerprint(gdf.copy())
+
+
+def test_options(gdf):
+    assert cache.fingerprint(gdf, precision=2) != cache.fingerprint(gdf, precision=3)
+
+
+def test_value(gdf):
+    changed = gdf.copy()
+    changed.loc[0, "count"] += 1
+    assert cache.fingerprint(gdf) != cache.fingerprint(changed)
+
+
+def test_geometry(gdf):
+    changed = gdf.copy()
+    changed.geometry = changed.geometry.translate(1e-9)
+    assert cache.fingerprint(gdf) != cache.fingerprint(changed)
+
+
+def test_object_types():
+    """ values that differ only in type """
+    a = pd.DataFrame(dict(x=[1, "a"]))
+    b = pd.DataFrame(dict(x=["1", "a"]))
+    assert cache.fingerprint(a) != cache.fingerprint(b)
+    a = pd.DataFrame(dict(x=[True, None], y=[[1, 2], "a"]))
+    b = pd.DataFrame(dict(x=["True", None], y=[[1, 2], "a"]))
+    assert cache.fingerprint(a) != cache.fingerprint(b)
+
+
+def test_strings():
+    a = pd.DataFrame(dict(x=np.array(["a", "b", None], dtype=object)))
+    b = pd.DataFrame(dict(x=np.array(["a", "c", None], dtype=object)))
+    assert cache.fingerprint(a) != cache.fingerprint(b)
+
+
+def test_iterdumps(gdf):
+    """ streamed text is cached only if kept """
+    from pymapbox import encode
+
+    cache.sources.clear()
+    text = "".join(cache.iterdumps(gdf))
+    assert text == encode.dumps(gdf)
+    assert cache.sources.stats()["items"] == 0
+    assert "".join(cache.iterdumps(gdf, keep=True)) == text
+    assert cache.sources.stats()["items"] == 1
+    assert "".join(cache.iterdumps(gdf)) == text
+    assert cache.sources.stats()["hits"] == 1
+
+
+def test_simplify(gdf):
+    """ geometry is simplified once for each tolerance and shared by dataframes with other columns """
+    cache.simplified.clear()
+    a = cache.simplify(gdf, 0.1)
+    b = cache.simplify(gdf.assign(count=0), 0.1)
+    assert len(cache.simplified) == 1
+    assert a.geometry.equals(b.geometry)
+    assert b["count"].eq(0).all() and a["count"].equals(gdf["count"])
+    assert a.geometry.equals(gdf.geometry.simplify(0.1))
+    cache.simplify(gdf, 0.2)
+    assert len(cache.simplified) == 2
+    assert cache.simplify(gdf, 0) is gdf
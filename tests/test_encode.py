@@ -0,0 +1,75 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from pymapbox import encode
+
+
+def features(text):
+    return json.loads(text)["features"]
+
+
+def test_matches_geopandas(gdf):
+    """ same properties and geometry as geopandas to_json """
+    gdf = gdf.drop(columns="nullable")
+    gdf["ratio"] = gdf.ratio.replace(np.inf, np.nan)
+    expected = features(gdf.to_json())
+    for f in expected:
+        f.pop("id", None)
+        f.pop("bbox", None)
+    assert features(encode.dumps(gdf)) == expected
+
+
+def test_missing(gdf):
+    """ NaN, inf, pd.NA and missing categories are null """
+    props = [f["properties"] for f in features(encode.dumps(gdf))]
+    assert props[1]["ratio"] is None
+    assert props[5]["ratio"] is None
+    assert props[1]["nullable"] is None
+    assert props[2]["party"] is None
+    assert [p["nullable"] for p in props] == [1, None, 3, 4, None, 6, 7]
+
+
+def test_nullable_types():
+    df = pd.DataFrame(
+        dict(
+            b=pd.array([True, None], dtype="boolean"),
+            s=pd.array(["x", None], dtype="string"),
+            geometry=[None, None],
+        )
+    )
+    props = [f["properties"] for f in features(encode.dumps(df))]
+    assert props == [dict(b=True, s="x"), dict(b=None, s=None)]
+
+
+def test_columns(gdf):
+    props = [f["properties"] for f in features(encode.dumps(gdf, columns=["name"]))]
+    assert props[1] == dict(name="Jane's")
+
+
+def test_chunks(gdf):
+    """ chunked text is the same as one pass """
+    assert "".join(encode.iterdumps(gdf, chunksize=3)) == encode.dumps(gdf)
+
+
+def test_precision(gdf):
+    out = features(encode.dumps(gdf, precision=1))
+    assert out[0]["geometry"]["coordinates"] == [-1.7, 52.2]
+
+    # rounding removes duplicate vertices and degenerate rings
+    polygon = out[2]["geometry"]
+    assert polygon["coordinates"][0] == [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+    assert polygon["coordinates"][1] == [[0.2, 0.2], [0.4, 0.2], [0.4, 0.4], [0.2, 0.2]]
+    assert features(encode.dumps(gdf, precision=0))[2]["geometry"]["coordinates"] == [
+        [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+    ]
+
+
+def test_ragged_loop(gdf):
+    """ shapely<2 loop gives the same arrays as the vectorized path """
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    a = encode.Ragged.from_geoms(geoms)
+    b = encode.Ragged._from_geoms_loop(geoms)
+    for k in ["types", "coords", "rings", "parts", "geoms"]:
+        assert np.array_equal(getattr(a, k), getattr(b, k))
@@ -0,0 +1,25 @@
+""" properties referenced by mapbox expressions, filters and style functions """
+
+import pytest
+
+from pymapbox.utils import expression_columns
+
+
+@pytest.mark.parametrize(
+    "expr, expected",
+    [
+        (["match", ["get", "party"], "LD", "orange", "white"], {"party"}),
+        (["==", "party", "LD"], {"party"}),
+        (["all", ["has", "ratio"], [">", ["get", "votes"], 0]], {"ratio", "votes"}),
+        ("{wardname} {party}", {"wardname", "party"}),
+        (dict(property="ratio", stops=[[0, "red"], [100, "blue"]]), {"ratio"}),
+        ("orange", set()),
+        (["properties"], None),
+        (["get", ["concat", "ratio", "2019"]], None),
+        (["to-number", ["get", ["get", "column"]]], None),
+        (["!has", ["concat", "party", "2019"]], None),
+        (dict(property="ratio", stops=[[0, ["get", ["concat", "a", "b"]]]]), None),
+    ],
+)
+def test_expression_columns(expr, expected):
+    assert expression_columns(expr) == expected
@@ -0,0 +1,45 @@
+""" fuzzyscores with trigram candidates finds the same best match as scoring all pairs """
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fuzzywuzzy")
+pytest.importorskip("scipy")
+
+from pymapbox.utils import fuzzyscores
+
+
+@pytest.fixture
+def names():
+    """ queries are choices with typos and swapped words """
+    rng = np.random.default_rng(0)
+    letters = list("abcdefghijklmnopqrstuvwxyz")
+    words = ["".join(rng.choice(letters, rng.integers(3, 9))) for _ in range(30)]
+    choices = [" ".join(rng.choice(words, 3)) for _ in range(120)]
+    queries = []
+    for c in choices[::3]:
+        q = list(c)
+        for i in rng.integers(0, len(q), 3):
+            q[i] = rng.choice(letters)
+        queries.append(" ".join(reversed("".join(q).split())))
+    return queries, choices
+
+
+def best(row):
+    return max([s for _, s in row] or [0])
+
+
+def test_no_minscore(names):
+    queries, choices = names
+    blocked = fuzzyscores(queries, choices, candidates=3, minscore=0)
+    full = fuzzyscores(queries, choices, candidates=None)
+    assert [best(r) for r in blocked] == [best(r) for r in full]
+
+
+def test_minscore(names):
+    """ best is as scoring all pairs below minscore and at least minscore above """
+    queries, choices = names
+    blocked = fuzzyscores(queries, choices, candidates=3, minscore=80)
+    full = fuzzyscores(queries, choices, candidates=None)
+    for a, b in zip(map(best, blocked), map(best, full)):
+        assert a == b if b < 80 else 80 <= a <= b
@@ -0,0 +1,34 @@
+""" import pymapbox is fast and does not load heavy packages """
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+root = Path(__file__).parent.parent
+
+# generous so slow machines pass. heavy imports take several seconds.
+SECONDS = 2
+
+HEAVY = ["pandas", "geopandas", "shapely", "plotly", "IPython", "yatl", "colour"]
+
+code = f"""
+import json, sys, time
+start = time.perf_counter()
+import pymapbox
+seconds = time.perf_counter() - start
+print(json.dumps(dict(seconds=seconds, loaded=[m for m in {HEAVY!r} if m in sys.modules])))
+"""
+
+
+def test_import():
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    assert result["loaded"] == []
+    assert result["seconds"] < SECONDS
@@ -0,0 +1,52 @@
+""" points2border gives the same borders as the two pass spatial join implementation """
+
+import numpy as np
+import pytest
+
+shapely = pytest.importorskip("shapely")
+gpd = pytest.importorskip("geopandas")
+pytest.importorskip("scipy")
+
+from pymapbox.utils import _points2border_sjoin, points2border
+
+
+@pytest.fixture
+def points():
+    """ points in areas of about 50 points. 2% are in another area and some are duplicated.
+    no area has two parts with the same number of points as the two pass implementation breaks ties arbitrarily.
+    """
+    from scipy.spatial import cKDTree
+
+    rng = np.random.default_rng(0)
+    n = 3000
+    seeds = rng.random((n // 50, 2))
+    coords = rng.random((n, 2))
+    area = cKDTree(seeds).query(coords)[1]
+    noise = rng.random(n) < 0.02
+    area[noise] = rng.integers(0, len(seeds), noise.sum())
+    coords = np.vstack([coords, coords[:5]])
+    area = np.r_[area, (area[:5] + 1) % len(seeds)]
+    return gpd.GeoDataFrame(
+        dict(key=[f"a{x:03d}" for x in area]),
+        geometry=gpd.points_from_xy(*coords.T),
+        crs="epsg:4326",
+    )
+
+
+@pytest.mark.skipif(not hasattr(shapely, "get_parts"), reason="shapely<2 uses sjoin")
+def test_same_as_sjoin(points):
+    new = points2border(points, "key", workers=1)
+    old = _points2border_sjoin(points, "key")
+    assert new.index.equals(old.index)
+    a, b = old.geometry.align(new.geometry)
+    assert a.symmetric_difference(b).area.sum() == pytest.approx(0, abs=1e-12)
+
+
+@pytest.mark.skipif(not hasattr(shapely, "get_parts"), reason="shapely<2 uses sjoin")
+def test_coverage(points):
+    """ borders do not overlap and leave no gaps """
+    borders = np.asarray(points2border(points, "key", workers=1).geometry.values)
+    union = shapely.union_all(borders)
+    assert union.geom_type == "Polygon"
+    assert len(union.interiors) == 0
+    assert shapely.area(borders).sum() == pytest.approx(union.area, rel=1e-9)
@@ -0,0 +1,167 @@
+""" tiles decode to the source features and are rebuilt only when their features change """
+
+import math
+
+import numpy as np
+import pytest
+
+from pymapbox import tiles
+
+mvt = pytest.importorskip("mapbox_vector_tile")
+gpd = pytest.importorskip("geopandas")
+
+EXTENT = 4096
+
+
+def read(path, key):
+    """ return features of layer in tile z/x/y with tile coordinates y down """
+    data = (path / f"{key}.pbf").read_bytes()
+    layers = mvt.decode(data, default_options=dict(y_coord_down=True))
+    return layers
+
+
+def lonlat(key, x, y):
+    """ return lon, lat of tile coordinates """
+    z, tx, ty = map(int, key.split("/"))
+    n = 2 ** z
+    lon = (tx + x / EXTENT) / n * 360 - 180
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (ty + y / EXTENT) / n))))
+    return lon, lat
+
+
+@pytest.fixture
+def points():
+    return gpd.GeoDataFrame(
+        dict(name=["a", "b", "c"], votes=[1, 2, 3], ratio=[0.5, np.nan, 2.0]),
+        geometry=gpd.points_from_xy([-1.7, 0.1, 2.5], [52.2, 51.5, 48.9]),
+        crs="epsg:4326",
+    )
+
+
+def test_points(tmp_path, points):
+    written = tiles.write_tiles(points, tmp_path, 0, 4, layer="w", workers=1)
+    assert written == len(list(tmp_path.rglob("*.pbf")))
+
+    layers = read(tmp_path, "0/0/0")
+    assert list(layers) == ["w"]
+    features = layers["w"]["features"]
+    assert len(features) == 3
+    props = [f["properties"] for f in features]
+    assert props == [
+        dict(name="a", votes=1, ratio=0.5),
+        dict(name="b", votes=2),
+        dict(name="c", votes=3, ratio=2.0),
+    ]
+
+    # position is within a tile pixel
+    for key in ["0/0/0", "4/7/5"]:
+        for f in read(tmp_path, key)["w"]["features"]:
+            i = ["a", "b", "c"].index(f["properties"]["name"])
+            lon, lat = lonlat(key, *f["geometry"]["coordinates"])
+            z = int(key.split("/")[0])
+            pixel = 360 / 2 ** z / EXTENT
+            assert lon == pytest.approx(points.geometry.x[i], abs=pixel)
+            assert lat == pytest.approx(points.geometry.y[i], abs=pixel)
+
+
+def test_geometry_types(tmp_path, gdf):
+    tiles.write_tiles(gdf, tmp_path, 0, 0, layer="w", workers=1)
+    features = read(tmp_path, "0/0/0")["w"]["features"]
+    decoded = {f["properties"]["name"]: f["geometry"]["type"] for f in features}
+    expected = dict(zip(gdf.name, gdf.geom_type))
+    del expected[gdf.name[gdf.geometry.isna()].iloc[0]]
+    assert decoded == expected
+
+
+def test_polygon_area(tmp_path):
+    """ area in tile coordinates matches the projected polygon """
+    from shapely.geometry import box, shape
+
+    square = gpd.GeoDataFrame(
+        dict(id=[1]), geometry=[box(0.1, 0.1, 0.6, 0.5)], crs="epsg:4326"
+    )
+    tiles.write_tiles(square, tmp_path, 6, 6, layer="w", workers=1)
+    (key,) = [
+        p.relative_to(tmp_path).with_suffix("").as_posix()
+        for p in tmp_path.rglob("*.pbf")
+    ]
+    (f,) = read(tmp_path, key)["w"]["features"]
+    decoded = shape(f["geometry"])
+    size = tiles.WORLD / 2 ** 6
+    expected = square.to_crs(epsg=3857).area[0] * (EXTENT / size) ** 2
+    # vertices are rounded to tile pixels
+    assert decoded.area == pytest.approx(expected, rel=5e-3)
+
+
+def test_incremental(tmp_path, points):
+    first = tiles.write_tiles(points, tmp_path, 0, 4, layer="w", workers=1)
+    assert tiles.write_tiles(points, tmp_path, 0, 4, layer="w", workers=1) == 0
+
+    # only tiles with the changed feature are rebuilt
+    changed = points.copy()
+    changed.loc[2, "votes"] = 30
+    written = tiles.write_tiles(changed, tmp_path, 0, 4, layer="w", workers=1)
+    assert 0 < written < first
+    votes = [f["properties"]["votes"] for f in read(tmp_path, "0/0/0")["w"]["features"]]
+    assert votes == [1, 2, 30]
+
+    # tiles without features are removed
+    fewer = changed.iloc[:1]
+    tiles.write_tiles(fewer, tmp_path, 0, 4, layer="w", workers=1)
+    tiles.write_tiles(fewer, tmp_path / "new", 0, 4, layer="w", workers=1)
+    old = {p.relative_to(tmp_path) for p in tmp_path.glob("[0-9]*/*/*.pbf")}
+    new = {p.relative_to(tmp_path / "new") for p in (tmp_path / "new").rglob("*.pbf")}
+    assert old == new
+
+
+def test_processes(tmp_path, points):
+    """ same tiles from worker processes """
+    tiles.write_tiles(points, tmp_path / "a", 0, 6, layer="w", workers=1)
+    tiles.write_tiles(points, tmp_path / "b", 0, 6, layer="w", workers=2)
+    a = sorted(p.relative_to(tmp_path / "a") for p in (tmp_path / "a").rglob("*.pbf"))
+    b = sorted(p.relative_to(tmp_path / "b") for p in (tmp_path / "b").rglob("*.pbf"))
+    assert a == b
+    for p in a:
+        assert (tmp_path / "a" / p).read_bytes() == (tmp_path / "b" / p).read_bytes()
+
+
+def test_multipoint(tmp_path):
+    """ parts of a multipoint are only in the tiles they are in """
+    from shapely.geometry import MultiPoint
+
+    far = gpd.GeoDataFrame(
+        dict(id=[1]), geometry=[MultiPoint([(-100, 40), (100, -40)])], crs="epsg:4326"
+    )
+    tiles.write_tiles(far, tmp_path, 2, 2, layer="w", workers=1)
+    found = dict()
+    for p in tmp_path.rglob("*.pbf"):
+        key = p.relative_to(tmp_path).with_suffix("").as_posix()
+        features = read(tmp_path, key).get("w", dict(features=[]))["features"]
+        if features:
+            found[key] = [f["geometry"]["type"] for f in features]
+    assert found == {"2/0/1": ["Point"], "2/3/2": ["Point"]}
+
+
+def test_tile_index():
+    """ same as each feature in each tile its bounds overlap """
+    rng = np.random.default_rng(0)
+    lo = rng.uniform(-tiles.ORIGIN, tiles.ORIGIN, (200, 2))
+    bounds = np.hstack([lo, lo + rng.uniform(0, tiles.WORLD / 8, (200, 2))])
+    bounds[5] = np.nan
+    z, pad = 4, 1000.0
+    size = tiles.WORLD / 2 ** z
+    expected = dict()
+    for i, (x0, y0, x1, y1) in enumerate(bounds):
+        if np.isnan(x0):
+            continue
+        for x in range(2 ** z):
+            for y in range(2 ** z):
+                minx = x * size - tiles.ORIGIN
+                maxy = tiles.ORIGIN - y * size
+                overlaps = x0 < minx + size + pad and x1 >= minx - pad
+                overlaps &= y0 <= maxy + pad and y1 > maxy - size - pad
+                if overlaps:
+                    expected.setdefault((x, y), []).append(i)
+    index = tiles._tile_index(bounds, z, pad)
+    assert list(index) == sorted(expected)
+    assert {k: v.tolist() for k, v in index.items()} == expected